@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# bench_fuzzy.py
+''' Time fuzzy matching (tox_fuzzy.py) of synthetic indices, with and
+    without the character bitmask prefilter.
+
+    python3 bench/bench_fuzzy.py [sizes...]      # default: 1000 10000 100000
+
+    For each size: the cost of computing the masks (when the sidecar is written),
+    then per query the number of entries passing the mask, the number
+    matching, and the time to match and score them all, prefiltered and not.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from tox_fuzzy import FuzzyQuery, pathMasks
+from bench_matchpaths import makePaths
+
+queries = ['src', 'srclib', 'tstcore', 'core/test', 'zqj', 'xyzzy', 'bin0']
+
+
+def timed(fn, repeat:int=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def main(sizes):
+    for n in sizes:
+        paths = makePaths(n)
+        dt, masks = timed(lambda: pathMasks(paths), 1)
+        print(f"{n} paths: masks built in {dt * 1e3:.1f} ms")
+        print(f"{'query':>10} {'passed':>8} {'matched':>8} {'ms':>8} {'no mask':>8}")
+        allBits = [-1] * n  # A mask every query passes
+        for q in queries:
+            fq = FuzzyQuery(q)
+            passed = sum(1 for m in masks if m & fq.mask == fq.mask)
+            dt, hits = timed(lambda: fq.match(paths.__getitem__, masks))
+            slow, _ = timed(lambda: fq.match(paths.__getitem__, allBits))
+            print(f"{q:>10} {passed:>8} {len(hits):>8} {dt * 1e3:>8.1f} {slow * 1e3:>8.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
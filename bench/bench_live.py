@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# bench_live.py
+''' Time the incremental menu (tox_live.py) over RankedMatches of synthetic
+    indices, as filterMatchingEntry() sets it up.
+
+    python3 bench/bench_live.py [sizes...]      # default: 10000 100000 1000000
+
+    For each size: the time to open the menu (rankAhead() and the first
+    draw), then of each keystroke typed after it, the slowest being those
+    which match nothing and so scan as far as tox_live.scanBudget allows.
+'''
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import tox_live
+from tox_core import RankedMatches
+from bench_matchpaths import makePaths
+
+keys = 'src#'  # The '#' matches nothing
+
+
+def main(sizes):
+    render = lambda item, selected: item[0]
+    matcher = lambda text: lambda item: text in item[0]
+    for n in sizes:
+        mx = RankedMatches([[(p, 1 + i % 3) for i, p in enumerate(makePaths(n))]])
+        t = time.perf_counter()
+        mx.rankAhead()
+        menu = tox_live.LiveMenu(((e[0], e) for e in mx), 40, matcher, render, io.StringIO())
+        menu.draw()
+        opened = time.perf_counter() - t
+        times = []
+        for c in keys:
+            t = time.perf_counter()
+            menu.key(c)
+            times.append(time.perf_counter() - t)
+        print(f"{n:>8} entries: menu opened in {opened * 1e3:.1f} ms, keystrokes "
+              + " ".join(f"{c!r}={dt * 1e3:.1f}ms" for c, dt in zip(keys, times)))
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000])
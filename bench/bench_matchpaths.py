@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# bench_matchpaths.py
+''' Compare the fragment index (tox_fragindex.py) against the original
+    per-entry fnmatch scan of IndexContent.matchPaths.
+
+    python3 bench/bench_matchpaths.py [sizes...]      # default: 1000 10000 100000
+'''
+import os
+import sys
+import time
+import random
+import fnmatch
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import tox_cache
+from tox_fragindex import FragmentIndex
+
+patterns = ['*src*', '*lib12*', 'c*', '*o?e*', '*[xz]ip*', '*nomatch*']
+
+
+def makePaths(n:int, seed:int=1):
+    """ Synthetic monorepo-ish tree of n dirs """
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz_') for _ in range(rnd.randint(3, 9)))
+             for _ in range(max(50, n // 20))]
+    words += ['src', 'lib', 'bin', 'core', 'test', 'zip']
+    paths = set()
+    while len(paths) < n:
+        depth = rnd.randint(1, 7)
+        p = '/'.join(rnd.choice(words) for _ in range(depth))
+        paths.add(p + str(rnd.randint(0, 20)) if rnd.random() < .3 else p)
+    return sorted(paths)
+
+
+def scanMatch(paths, pattern):
+    """ The original matchPaths loop, minus path rendering """
+    hits = []
+    for n, path in enumerate(paths):
+        for frag in path.split('/'):
+            if fnmatch.fnmatch(frag, pattern):
+                hits.append(n)
+    return sorted(set(hits))
+
+
+def timed(fn, *args, repeat:int=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        r = fn(*args)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best, r
+
+
+def main(sizes):
+    print(f"{'entries':>8} {'pattern':>12} {'scan ms':>9} {'fragix ms':>10} {'sidecar ms':>11} {'hits':>7}")
+    for n in sizes:
+        paths = makePaths(n)
+        buildTime, fx = timed(FragmentIndex.build, paths, repeat=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            ixpath = tmp + '/.tox-index'
+            with open(ixpath, 'w') as f:
+                f.write(''.join(p + ' 1\n' for p in paths))
+            st = os.stat(ixpath)
+            sig = (st.st_mtime_ns, st.st_size, st.st_ino, -1)
+            entries = tuple((p, 1) for p in paths)
+            saved = tox_cache.cacheThreshold
+            tox_cache.cacheThreshold = 0
+            try:
+                tox_cache.writeCache(ixpath, sig, entries, fx)
+            finally:
+                tox_cache.cacheThreshold = saved
+            loadTime, cache = timed(tox_cache.loadCache, ixpath, sig)
+            mapped = cache.fragmentIndex()
+            print(f"{n:>8} {'(build)':>12} {'':>9} {buildTime * 1e3:>10.2f} {loadTime * 1e3:>11.2f}")
+            for pattern in patterns:
+                scanTime, expect = timed(scanMatch, paths, pattern)
+                fxTime, got = timed(fx.match, [pattern])
+                mapTime, mgot = timed(mapped.match, [pattern])
+                assert got == expect == mgot, pattern
+                print(f"{n:>8} {pattern:>12} {scanTime * 1e3:>9.2f} {fxTime * 1e3:>10.2f} "
+                      f"{mapTime * 1e3:>11.2f} {len(got):>7}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# bench_setutils.py
+''' Microbenchmarks of setutils.IndexedSet (and CompactIndexedSet), per-item
+    operations against their bulk counterparts.
+
+    python3 bench/bench_setutils.py [sizes...]      # default: 1000 10000 100000 1000000
+
+    Operations, each on n items of which ~1/4 are duplicates:
+      build      IndexedSet(items): the ordered-dedup constructor
+      add        add() per item, into an empty set
+      update     update_many(items) into an empty set
+      union      s | other, other the same size and half overlapping
+      slice      s[n//4:3n//4]
+      pop        pop() of 1000 items (or all, if fewer) from the end
+      pop(0)     pop(0) of 1000 items (or all) from the front
+      discard    discard() per item, of every other item (n <= 10**5 only:
+                 it's quadratic)
+      discard_m  discard_many() of the same
+'''
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from setutils import IndexedSet, CompactIndexedSet
+
+
+def timed(fn, setup=None, repeat:int=3):
+    """ Best time of fn(setup()) over 'repeat' runs, setup not timed """
+    best = None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t = time.perf_counter()
+        fn(arg)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def addEach(items):
+    s = IndexedSet()
+    for item in items:
+        s.add(item)
+    return s
+
+
+def popEach(s, n, index=None):
+    for _ in range(min(n, len(s))):
+        s.pop(index)
+
+
+def discardEach(s, items):
+    for item in items:
+        s.discard(item)
+
+
+def main(sizes):
+    print(f"{'n':>8} {'operation':>10} {'ms':>10}")
+    for n in sizes:
+        rnd = random.Random(n)
+        items = [rnd.randrange(n * 3 // 4 or 1) for _ in range(n)]
+        other = [x + n // 2 for x in items]
+        half = items[::2]
+        base = IndexedSet(items)
+        repeat = 3 if n <= 100000 else 1
+        results = [
+            ("build", timed(lambda _: IndexedSet(items), repeat=repeat)),
+            ("add", timed(lambda _: addEach(items), repeat=repeat)),
+            ("update", timed(lambda _: IndexedSet().update_many(items), repeat=repeat)),
+            ("union", timed(lambda _: base | other, repeat=repeat)),
+            ("slice", timed(lambda _: base[n // 4:3 * n // 4], repeat=repeat)),
+            ("pop", timed(lambda s: popEach(s, 1000), lambda: IndexedSet(items), repeat)),
+            ("pop(0)", timed(lambda s: popEach(s, 1000, 0), lambda: IndexedSet(items), repeat)),
+            ("discard_m", timed(lambda s: s.discard_many(half), lambda: IndexedSet(items), repeat)),
+        ]
+        if n <= 100000:
+            results.insert(-1, ("discard", timed(lambda s: discardEach(s, half), lambda: IndexedSet(items), repeat)))
+        for name, dt in results:
+            print(f"{n:>8} {name:>10} {dt * 1e3:>10.2f}")
+    # Per-instance overhead, where the __slots__ variant helps:
+    for cls in (IndexedSet, CompactIndexedSet):
+        tracemalloc.start()
+        sets = [cls((i,)) for i in range(10000)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{cls.__name__}: {size / len(sets):.0f} bytes per 1-item set")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# bench_startup.py
+''' Measure tox_core.py cold-start cost per phase, using `python -X importtime`.
+
+    python3 bench/bench_startup.py [--runs N] [--budget-ms MS] [-- tox args...]
+
+    Phases reported (medians over N runs):
+      interpreter  `python -c pass`, i.e. the floor we can't do anything about
+      imports      modules tox_core.py pulls in beyond the interpreter's own
+      run          the rest: index discovery, load, matching, output
+    followed by the top-level imports sorted by cost.  With --budget-ms, exits
+    1 if the imports phase exceeds it, so regressions can fail a check.
+
+    By default this runs a plain lookup ('c1') in the repo's test1 tree, with a
+    throwaway HOME, tox_nodaemon=1 and .pyc writing enabled.
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+repo = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def run(cmd, env, cwd):
+    t = time.perf_counter()
+    r = subprocess.run(cmd, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    return time.perf_counter() - t, r.stderr
+
+
+def importTimes(stderr:str):
+    """ {module: cumulative us} for top-level imports in -X importtime output """
+    top = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):
+            continue  # Nested import, already included in its parent
+        top[name.strip()] = int(cumulative)
+    return top
+
+
+def main():
+    p = argparse.ArgumentParser(description="tox_core.py startup benchmark")
+    p.add_argument("--runs", type=int, default=10)
+    p.add_argument("--budget-ms", type=float, default=None)
+    p.add_argument("--cwd", default=os.path.join(repo, "test1"))
+    p.add_argument("toxargs", nargs="*", default=["c1"])
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        with open(os.path.join(home, ".tox-index"), "w") as f:
+            f.write("# bench home index\n")
+        env = dict(os.environ, HOME=home, PWD=args.cwd, tox_nodaemon="1")
+        env.pop("tox_log", None)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)  # Users get cached .pyc files
+        tox = [sys.executable, os.path.join(repo, "tox_core.py")] + args.toxargs
+        bare = [sys.executable, "-c", "pass"]
+
+        run(tox, env, args.cwd)  # Warm up .pyc files and the page cache
+        baseline = set(importTimes(run([sys.executable, "-X", "importtime", "-c", "pass"], env, args.cwd)[1]))
+        walls, bareWalls, imports = [], [], {}
+        for _ in range(args.runs):
+            bareWalls.append(run(bare, env, args.cwd)[0])
+            walls.append(run(tox, env, args.cwd)[0])
+            for name, us in importTimes(run([sys.executable, "-X", "importtime"] + tox[1:], env, args.cwd)[1]).items():
+                if name not in baseline:
+                    imports.setdefault(name, []).append(us)
+
+    interp = statistics.median(bareWalls) * 1e3
+    total = statistics.median(walls) * 1e3
+    perModule = sorted(((statistics.median(v) / 1e3, k) for k, v in imports.items()), reverse=True)
+    importMs = sum(ms for ms, _ in perModule)
+    print(f"tox_core.py {' '.join(args.toxargs)}  ({args.runs} runs, medians)")
+    print(f"  {'interpreter':<12} {interp:8.2f} ms")
+    print(f"  {'imports':<12} {importMs:8.2f} ms")
+    print(f"  {'run':<12} {max(0.0, total - interp - importMs):8.2f} ms")
+    print(f"  {'total':<12} {total:8.2f} ms")
+    print("\n  top-level imports:")
+    for ms, name in perModule:
+        print(f"    {ms:8.2f} ms  {name}")
+    if args.budget_ms is not None and importMs > args.budget_ms:
+        print(f"\nimports phase {importMs:.2f} ms exceeds budget {args.budget_ms:.2f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,8 +13,11 @@ characteristics of Python's built-in set implementation.
 from __future__ import print_function
 
 from bisect import bisect_left
-from itertools import chain, islice
-from collections import MutableSet
+from itertools import chain, count, filterfalse, islice
+try:
+    from collections.abc import MutableSet
+except ImportError:
+    from collections import MutableSet
 import operator
 
 try:
@@ -24,62 +27,23 @@ except ImportError:
     _MISSING = object()
 
 
-__all__ = ['IndexedSet']
+__all__ = ['IndexedSet', 'CompactIndexedSet']
 
 
 _COMPACTION_FACTOR = 8
 
 # TODO: inherit from set()
-# TODO: .discard_many(), .remove_many()
 # TODO: raise exception on non-set params?
 # TODO: technically reverse operators should probably reverse the
 # order of the 'other' inputs and put self last (to try and maintain
 # insertion order)
 
 
-class IndexedSet(MutableSet):
-    """``IndexedSet`` is a :class:`collections.MutableSet` that maintains
-    insertion order and uniqueness of inserted elements. It's a hybrid
-    type, mostly like an OrderedSet, but also :class:`list`-like, in
-    that it supports indexing and slicing.
-
-    Args:
-        other (iterable): An optional iterable used to initialize the set.
-
-    >>> x = IndexedSet(list(range(4)) + list(range(8)))
-    >>> x
-    IndexedSet([0, 1, 2, 3, 4, 5, 6, 7])
-    >>> x - set(range(2))
-    IndexedSet([2, 3, 4, 5, 6, 7])
-    >>> x[-1]
-    7
-    >>> fcr = IndexedSet('freecreditreport.com')
-    >>> ''.join(fcr[:fcr.index('.')])
-    'frecditpo'
-
-    Standard set operators and interoperation with :class:`set` are
-    all supported:
-
-    >>> fcr & set('cash4gold.com')
-    IndexedSet(['c', 'd', 'o', '.', 'm'])
-
-    As you can see, the ``IndexedSet`` is almost like a ``UniqueList``,
-    retaining only one copy of a given value, in the order it was
-    first added. For the curious, the reason why IndexedSet does not
-    support setting items based on index (i.e, ``__setitem__()``),
-    consider the following dilemma::
-
-      my_indexed_set = [A, B, C, D]
-      my_indexed_set[2] = A
-
-    At this point, a set requires only one *A*, but a :class:`list` would
-    overwrite *C*. Overwriting *C* would change the length of the list,
-    meaning that ``my_indexed_set[2]`` would not be *A*, as expected with a
-    list, but rather *D*. So, no ``__setitem__()``.
-
-    Otherwise, the API strives to be as complete a union of the
-    :class:`list` and :class:`set` APIs as possible.
-    """
+class _IndexedSetBase(MutableSet):
+    """Implementation shared by :class:`IndexedSet` and
+    :class:`CompactIndexedSet`, see the former for its docs."""
+    __slots__ = ('item_index_map', 'item_list', 'dead_indices',
+                 '_compactions', '_c_max_size')
 
     def __init__(self, other=None):
         self.item_index_map = dict()
@@ -88,7 +52,7 @@ class IndexedSet(MutableSet):
         self._compactions = 0
         self._c_max_size = 0
         if other:
-            self.update(other)
+            self.update_many(other)
 
     # internal functions
     @property
@@ -179,7 +143,7 @@ class IndexedSet(MutableSet):
         return '%s(%r)' % (self.__class__.__name__, list(self))
 
     def __eq__(self, other):
-        if isinstance(other, IndexedSet):
+        if isinstance(other, _IndexedSetBase):
             return len(self) == len(other) and list(self) == list(other)
         return set(self) == set(other)
 
@@ -212,6 +176,33 @@ class IndexedSet(MutableSet):
         except KeyError:
             pass
 
+    def discard_many(self, *others):
+        "discard_many(*others) -> discard the values of iterables, in bulk"
+        iim, items = self.item_index_map, self.item_list
+        dropped = 0
+        for other in others:
+            for item in other:
+                didx = iim.pop(item, None)
+                if didx is not None:
+                    items[didx] = _MISSING
+                    dropped += 1
+        if dropped:
+            # One pass instead of a _cull() per item:
+            items[:] = [item for item in items if item is not _MISSING]
+            self.item_index_map = dict(zip(items, count()))
+            del self.dead_indices[:]
+
+    def remove_many(self, *others):
+        "remove_many(*others) -> remove values, raises (removing none) if any are missing"
+        others = [list(other) if iter(other) is other else other
+                  for other in others]  # Iterators get read twice
+        iim = self.item_index_map
+        for other in others:
+            for item in other:
+                if item not in iim:
+                    raise KeyError(item)
+        self.discard_many(*others)
+
     def clear(self):
         "clear() -> empty the set"
         del self.item_list[:]
@@ -296,14 +287,22 @@ class IndexedSet(MutableSet):
     # in-place set operations
     def update(self, *others):
         "update(*others) -> add values from one or more iterables"
-        if not others:
-            return  # raise?
-        elif len(others) == 1:
-            other = others[0]
-        else:
-            other = chain(others)
-        for o in other:
-            self.add(o)
+        self.update_many(*others)
+
+    def update_many(self, *others):
+        "update_many(*others) -> add values from iterables, in bulk"
+        for other in others:
+            new = dict.fromkeys(other)  # Ordered dedup, at dict speed
+            iim, items = self.item_index_map, self.item_list
+            if items:
+                new = list(filterfalse(iim.__contains__, new))
+                iim.update(zip(new, count(len(items))))
+                items.extend(new)
+            else:
+                # Reuse the dedup dict as our index map
+                items.extend(new)
+                new.update(zip(items, count()))
+                self.item_index_map = new
 
     def intersection_update(self, *others):
         "intersection_update(*others) -> discard self.difference(*others)"
@@ -420,3 +419,58 @@ class IndexedSet(MutableSet):
         except KeyError:
             cn = self.__class__.__name__
             raise ValueError('%r is not in %s' % (val, cn))
+
+
+class IndexedSet(_IndexedSetBase):
+    """``IndexedSet`` is a :class:`collections.MutableSet` that maintains
+    insertion order and uniqueness of inserted elements. It's a hybrid
+    type, mostly like an OrderedSet, but also :class:`list`-like, in
+    that it supports indexing and slicing.
+
+    Args:
+        other (iterable): An optional iterable used to initialize the set.
+
+    >>> x = IndexedSet(list(range(4)) + list(range(8)))
+    >>> x
+    IndexedSet([0, 1, 2, 3, 4, 5, 6, 7])
+    >>> x - set(range(2))
+    IndexedSet([2, 3, 4, 5, 6, 7])
+    >>> x[-1]
+    7
+    >>> fcr = IndexedSet('freecreditreport.com')
+    >>> ''.join(fcr[:fcr.index('.')])
+    'frecditpo'
+
+    Standard set operators and interoperation with :class:`set` are
+    all supported:
+
+    >>> fcr & set('cash4gold.com')
+    IndexedSet(['c', 'd', 'o', '.', 'm'])
+
+    As you can see, the ``IndexedSet`` is almost like a ``UniqueList``,
+    retaining only one copy of a given value, in the order it was
+    first added. For the curious, the reason why IndexedSet does not
+    support setting items based on index (i.e, ``__setitem__()``),
+    consider the following dilemma::
+
+      my_indexed_set = [A, B, C, D]
+      my_indexed_set[2] = A
+
+    At this point, a set requires only one *A*, but a :class:`list` would
+    overwrite *C*. Overwriting *C* would change the length of the list,
+    meaning that ``my_indexed_set[2]`` would not be *A*, as expected with a
+    list, but rather *D*. So, no ``__setitem__()``.
+
+    Otherwise, the API strives to be as complete a union of the
+    :class:`list` and :class:`set` APIs as possible.
+    """
+
+
+class CompactIndexedSet(_IndexedSetBase):
+    """An :class:`IndexedSet` without a per-instance ``__dict__`` (nor
+    weak reference support), for when there are many small ones.
+
+    >>> CompactIndexedSet('abracadabra')
+    CompactIndexedSet(['a', 'b', 'r', 'c', 'd'])
+    """
+    __slots__ = ()
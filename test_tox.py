@@ -41,6 +41,830 @@ def test_3():
         ix = loadIndex()
 
 
+def test_serve_matches_in_process(tmp_path):
+    # A forwarded request must print exactly what an in-process run prints:
+    import subprocess
+    import time
+    sock = str(tmp_path / 'tox.sock')
+    env = dict(os.environ, tox_socket=sock, PWD=tox_core_root + '/test1')
+    core = tox_core_root + '/tox_core.py'
+    server = subprocess.Popen([sys.executable, core, '--serve'], env=env,
+                              stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.02)
+        run = lambda e: subprocess.run([sys.executable, core, '-p', '1'], env=e, cwd=env['PWD'],
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        served = run(env)
+        local = run(dict(env, tox_nodaemon='1'))
+        assert served.returncode == local.returncode == 0
+        assert served.stdout == local.stdout
+        assert b'a1/b1/c1' in served.stdout
+    finally:
+        server.terminate()
+        server.wait()
+    assert not os.path.exists(sock)
+
+
+def test_log_follows_environment(tmp_path, monkeypatch):
+    import logging
+    monkeypatch.delenv('tox_log', raising=False)
+    log("nowhere")
+    for name in ('first.log', 'second.log'):  # As a --serve worker would see it
+        monkeypatch.setenv('tox_log', str(tmp_path / name))
+        log("to " + name)
+    logging.shutdown()
+    assert "to first.log" in (tmp_path / 'first.log').read_text()
+    assert (tmp_path / 'second.log').read_text().count("to ") == 1
+
+
+def test_serve_interactive_menu(tmp_path):
+    # Started like tox_serve does, in a process group of the terminal's
+    # session that isn't its foreground one, the server mustn't be stopped
+    # (SIGTTOU) when a forwarded lookup puts the terminal in raw mode:
+    import pty
+    import select
+    import signal
+    import socket
+    import struct
+    import termios
+    import time
+    (tmp_path / 'src' / 'a').mkdir(parents=True)
+    (tmp_path / 'src' / 'b').mkdir(parents=True)
+    (tmp_path / indexFileBase).write_text('src/a\nsrc/b\n')
+    sock = str(tmp_path / 'tox.sock')
+    core = tox_core_root + '/tox_core.py'
+    env = dict(os.environ, tox_socket=sock, HOME=str(tmp_path), PWD=str(tmp_path),
+               ToxSysRoot=str(tmp_path))
+    for k in ('tox_nodaemon', 'tox_incremental', 'tox_fuzzy'):
+        env.pop(k, None)
+    pid, tty = pty.fork()
+    if pid == 0:  # Our terminal's session leader, standing in for bash
+        try:
+            os.chdir(str(tmp_path))
+            if os.fork() == 0:
+                os.setpgid(0, 0)  # The ( ... & ) subshell, a job of its own
+                os.execve('/bin/sh', ['sh', '-c', f'"{sys.executable}" "{core}" --serve '
+                                      '</dev/null >/dev/null 2>&1 &'], env)
+            for _ in range(250):
+                if os.path.exists(sock):
+                    break
+                time.sleep(0.02)
+            os.execve(sys.executable, [sys.executable, core, 'src'], env)
+        finally:
+            os._exit(127)
+    out = b''
+    chose = 0
+    try:
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            if select.select([tty], [], [], 0.1)[0]:
+                try:
+                    chunk = os.read(tty, 1024)
+                except OSError:
+                    chunk = b''  # The client exited
+                if not chunk:
+                    status, pid = os.waitpid(pid, 0)[1], None
+                    break
+                out += chunk
+            if not chose and b'Choose:' in out and not termios.tcgetattr(tty)[3] & termios.ICANON:
+                chose = os.write(tty, b'1')  # Once in raw mode, whose setup flushes input
+    finally:
+        if pid:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        os.close(tty)
+        if os.path.exists(sock):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            probe.connect(sock)
+            server = struct.unpack('3i', probe.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))[0]
+            probe.close()
+            os.kill(server, signal.SIGKILL)
+    assert pid is None and os.WEXITSTATUS(status) == 0, out
+    assert out.splitlines()[-1] == b'src/b', out
+
+
+def test_forward_checks_peer(tmp_path, monkeypatch):
+    import socket
+    import tox_daemon
+    import pytest
+    sock = str(tmp_path / 'tox.sock')
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(sock)
+    listener.listen(1)
+    monkeypatch.setenv('tox_socket', sock)
+    monkeypatch.delenv('tox_nodaemon', raising=False)
+    try:
+        # A server run by someone else gets nothing, and we run in-process:
+        monkeypatch.setattr(tox_daemon, 'peerUid', lambda conn: os.getuid() + 1)
+        assert tox_daemon.forward(['-p', 'x']) is None
+        listener.settimeout(1)
+        conn, _ = listener.accept()
+        assert conn.recv(100) == b''
+        conn.close()
+    finally:
+        listener.close()
+    a, b = socket.socketpair(socket.AF_UNIX)
+    monkeypatch.undo()
+    assert tox_daemon.peerUid(a) in (None, os.getuid())
+    a.close(), b.close()
+    # The runtime dir has to be ours alone:
+    shared = tmp_path / 'shared'
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(shared))
+    with pytest.raises(PermissionError):
+        tox_daemon.runtimePath('.sock')
+
+
+def test_index_sidecar_cache(tmp_path):
+    import tox_cache
+    ixpath = str(tmp_path / indexFileBase)
+    with open(ixpath, 'w') as f:
+        f.write("#protect\n")
+        for i in range(tox_cache.cacheThreshold):
+            f.write("d%d/sub%d %d\n" % (i, i % 7, 1 + i % 3))
+        f.write("/abs/elsewhere\n")
+    parsed = IndexContent(ixpath)
+    assert os.path.isfile(tox_cache.cachePath(ixpath))
+
+    # A fresh process would be served from the sidecar:
+    parsedIndexCache.clear()
+    sidecar = tox_cache.loadCache(ixpath, indexSignature(ixpath))
+    assert sidecar is not None
+    assert IndexContent(ixpath) == parsed
+    count = tox_cache.cacheThreshold
+    assert sidecar.fragmentIndex().match(['sub1']) == [i for i in range(count) if i % 7 == 1]
+    from tox_fuzzy import pathMasks
+    assert list(sidecar.fuzzyMasks) == list(pathMasks(e[0] for e in parsed))
+    assert IndexContent(ixpath).fuzzyMasks() is parsedIndexCache[ixpath].sidecar.fuzzyMasks
+    hit = parsedIndexCache[ixpath]
+    assert hit.hasPath('d0/sub0') and hit.hasPath('/abs/elsewhere') and not hit.hasPath('d0')
+
+    # Any change to the text index invalidates it:
+    with open(ixpath, 'a') as f:
+        f.write("late 5\n")
+    assert tox_cache.loadCache(ixpath, indexSignature(ixpath)) is None
+    parsedIndexCache.clear()
+    assert IndexContent(ixpath)[-1] == ('late', 5)
+    assert tox_cache.loadCache(ixpath, indexSignature(ixpath)) is not None
+
+
+def test_fragment_index_agrees_with_fnmatch():
+    import fnmatch
+    from tox_fragindex import FragmentIndex, literalRuns
+    assert literalRuns('*ab?cd[xy]ef*') == ['ab', 'cd', 'ef']
+    assert literalRuns('[!]x]*[oops') == ['[oops']
+    paths = ['src/abc/lib', 'src/xabcx', '/abs/abc', 'a1/b1/c1', 'src/src', 'docs', 'x[1]/y']
+    fx = FragmentIndex.build(paths)
+    for pattern in ['*abc*', 'c*', '*1', '*', 'src', '*b?c*', '*[xy]ab*', '*zzz*', '*[1*', '']:
+        expect = [n for n, p in enumerate(paths)
+                  if any(fnmatch.fnmatch(f, pattern) for f in p.split('/'))]
+        assert fx.match([pattern]) == expect, pattern
+    assert fx.match(['src', '*abc*']) == [0, 1]
+
+
+def test_match_rendering_needs_no_stat(monkeypatch):
+    import tox_core
+    def no_stat(path):
+        raise AssertionError("isdir(%s) called while matching" % path)
+    monkeypatch.setattr(tox_core, 'isdir', no_stat)
+    root = tox_core_root + '/test1'
+    ix = IndexContent(root + '/' + indexFileBase)
+    monkeypatch.setenv('PWD', root)
+    assert ('a1/b1/c1', 1) in ix.matchPaths(['c*'])
+    assert ('x1/bin', 1) in ix.matchPaths(['bin'])
+    monkeypatch.setenv('PWD', root + '/a1')
+    assert ix.matchPaths(['c*']) == [(root + '/a1/b1/c1', 1)]
+    assert ix.matchPaths(['c*'], True) == [(root + '/a1/b1/c1', 1)]
+
+
+def test_discovery_cache_invalidation(tmp_path, monkeypatch):
+    import tox_core
+    root = str(tmp_path)
+    deep = tmp_path / 'p' / 'q' / 'r'
+    deep.mkdir(parents=True)
+    (tmp_path / indexFileBase).write_text('p\n')
+    probes = []
+    realSearch = tox_core.searchIndex
+    def countingSearch(xdir, only_mine, probed):
+        probes.append(xdir)
+        return realSearch(xdir, only_mine, probed)
+    monkeypatch.setattr(tox_core, 'searchIndex', countingSearch)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        assert findIndex(str(deep)) == root + '/' + indexFileBase
+        assert len(probes) == 4
+        assert findIndex(str(deep)) == root + '/' + indexFileBase
+        assert len(probes) == 4  # answered from the cache
+
+        # A new index closer to xdir changes its dir's mtime:
+        (tmp_path / 'p' / indexFileBase).write_text('q\n')
+        assert findIndex(str(deep)) == root + '/p/' + indexFileBase
+        assert len(probes) > 4
+
+
+def test_owner_lookup_memoized(monkeypatch):
+    import tox_core
+    calls = []
+    class Pw:
+        pw_name = 'someone'
+    def fake_getpwuid(uid):
+        calls.append(uid)
+        return Pw
+    monkeypatch.setattr(tox_core, 'getpwuid', fake_getpwuid)
+    tox_core.userName.cache_clear()
+    monkeypatch.setenv('USER', 'someone')
+    try:
+        for _ in range(3):
+            assert ownerCheck(tox_core_root + '/test1', indexFileBase, True)
+        assert len(calls) == 1
+    finally:
+        tox_core.userName.cache_clear()
+
+
+def test_add_del_keep_sorted(tmp_path):
+    import pytest
+    ixpath = str(tmp_path / indexFileBase)
+    with open(ixpath, 'w') as f:
+        f.write("#protect\nzz 1\nmm 2\naa 1\n")
+    ix = IndexContent(ixpath)
+    assert ix.addDir(str(tmp_path / 'nn'), 1)
+    assert ix.addDir('mm', 5)  # update
+    with pytest.raises(AddEntryAlreadyPresent):
+        ix.addDir('mm', 5)
+    assert ix.delDir(str(tmp_path / 'aa'))
+    assert not ix.delDir('aa')
+    assert list(ix) == [('mm', 5), ('nn', 1), ('zz', 1)]
+    ix.write()
+    assert list(IndexContent(ixpath)) == list(ix)
+    assert ix.matchPaths(['nn'], True) == [(str(tmp_path / 'nn'), 1)]
+
+
+def test_recursive_add_writes_once(tmp_path, monkeypatch, capsys):
+    for d in ['a/b/c', 'a/.hidden/x', 'd']:
+        (tmp_path / d).mkdir(parents=True)
+    ixpath = str(tmp_path / indexFileBase)
+    with open(ixpath, 'w') as f:
+        f.write("#protect\nd 3\n")
+    writes = []
+    realWrite = IndexContent.write
+    def countingWrite(self):
+        writes.append(self.path)
+        realWrite(self)
+    monkeypatch.setattr(IndexContent, 'write', countingWrite)
+    monkeypatch.setenv('PWD', str(tmp_path))
+    with TmpSwap(file_sys_root, str(tmp_path), set_file_sys_root):
+        addDirsToIndex(['3', str(tmp_path)], True)
+    assert writes == [ixpath]
+    assert list(IndexContent(ixpath)) == [('a', 3), ('a/b', 3), ('a/b/c', 3), ('d', 3)]
+    assert "3 added, 0 updated, 1 already present" in capsys.readouterr().err
+
+
+def test_tree_walker(tmp_path, monkeypatch):
+    from tox_walk import TreeWalker
+    for d in ['a/b/c/d', 'a/node_modules/x', 'a/.git/objects', 'e/f', 'slow/never']:
+        (tmp_path / d).mkdir(parents=True)
+    os.symlink(str(tmp_path / 'e'), str(tmp_path / 'a/link'))
+    root = str(tmp_path)
+    rel = lambda ds: sorted(d[len(root) + 1:] for d in ds)
+
+    walker = TreeWalker(excludes=['node_modules'], workers=4)
+    assert rel(walker.walk(root)) == ['a', 'a/b', 'a/b/c', 'a/b/c/d', 'a/link', 'e', 'e/f',
+                                      'slow', 'slow/never']
+    assert rel(TreeWalker(maxDepth=2).walk(root)) == ['a', 'a/b', 'a/link', 'a/node_modules',
+                                                      'e', 'e/f', 'slow', 'slow/never']
+
+    # A listing that hangs is abandoned, the rest of the walk completes:
+    import time
+    walker = TreeWalker(timeout=0.2)
+    realList = walker._list
+    def hangingList(path, depth, dev):
+        if path.endswith('slow'):
+            time.sleep(5)
+        return realList(path, depth, dev)
+    monkeypatch.setattr(walker, '_list', hangingList)
+    started = time.monotonic()
+    found = rel(walker.walk(root))
+    assert time.monotonic() - started < 2
+    assert 'slow' in found and 'slow/never' not in found and 'a/b/c/d' in found
+    assert walker.timedOut == [root + '/slow']
+
+
+def test_clean_concurrent_with_timeout(tmp_path, monkeypatch, capsys):
+    import time
+    import tox_core
+    for d in ['here', 'also']:
+        (tmp_path / d).mkdir()
+    ixpath = str(tmp_path / indexFileBase)
+    text = "#protect\nzz 1\nhere 2\ngone 1\nhung 1\nalso 1\nhere 2\n"
+    with open(ixpath, 'w') as f:
+        f.write(text)
+    realIsdir = tox_core.isdir
+    def slowIsdir(path):
+        if path.endswith('/hung'):
+            time.sleep(5)
+        return realIsdir(path)
+    monkeypatch.setattr(tox_core, 'isdir', slowIsdir)
+
+    IndexContent(ixpath).clean(timeout=0.2, dryRun=True)
+    assert open(ixpath).read() == text
+    assert "3 of 6 entries" in capsys.readouterr().err
+
+    started = time.monotonic()
+    IndexContent(ixpath).clean(workers=2, timeout=0.2)
+    assert time.monotonic() - started < 2
+    err = capsys.readouterr().err
+    assert "kept: %s/hung" % tmp_path in err
+    assert "Stale dir removed: %s/gone" % tmp_path in err
+    assert open(ixpath).read() == "also 1\nhere 2\nhung 1\n"
+
+
+def test_complete_across_chain(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'proj' / 'src').mkdir(parents=True)
+    (tmp_path / indexFileBase).write_text("alpha 1\nbeta/gamma 1\nproj 1\n")
+    (tmp_path / 'proj' / indexFileBase).write_text("#protect\nsrc 1\nalpine/src 2\n")
+    monkeypatch.chdir(tmp_path / 'proj')
+    monkeypatch.setenv('PWD', str(tmp_path / 'proj'))
+    with TmpSwap(file_sys_root, str(tmp_path), set_file_sys_root):
+        assert completeFragments('al') == ['alpha', 'alpine']
+        assert completeFragments('', 3) == ['alpha', 'alpine', 'beta']
+        assert main(['--complete', 'g']) == 0
+    assert capsys.readouterr().out == "gamma\n"
+
+
+def test_visits_rank_and_compact(tmp_path, monkeypatch):
+    import time
+    import tox_visits
+    for d in ['src', 'lib/src']:
+        (tmp_path / d).mkdir(parents=True)
+    ixpath = str(tmp_path / indexFileBase)
+    (tmp_path / indexFileBase).write_text("src 1\nlib/src 1\n")
+    monkeypatch.setenv('PWD', str(tmp_path))
+    deep = str(tmp_path / 'lib/src')
+    assert IndexContent(ixpath).matchPaths(['src'])[0][0] == 'src'
+
+    now = time.time()
+    for n in range(3):
+        assert tox_visits.recordVisit(ixpath, deep, now)
+    assert IndexContent(ixpath).visits().score(deep, now) == 3.0
+    assert IndexContent(ixpath).matchPaths(['src'])[0][0] == 'lib/src'
+    # Half of it is gone after a half-life:
+    later = now + tox_visits.visitHalfLife
+    assert IndexContent(ixpath).visits().score(deep, later) == 1.5
+
+    # Compaction keeps the scores, and the log bounded:
+    monkeypatch.setattr(tox_visits, 'visitCompactAt', 4)
+    monkeypatch.setattr(tox_visits, 'visitMaxKeys', 2)
+    for n in range(5):
+        tox_visits.recordVisit(ixpath, '/elsewhere/%d' % n, now)
+    log = tox_visits.loadVisits(ixpath)
+    assert len(log.keys) <= 2 and log.appended < 4
+    assert abs(log.score(deep, later) - 1.5) < 1e-9  # Top score survives
+
+
+def test_lookup_records_visit(monkeypatch, capsys):
+    import tox_visits
+    root = tox_core_root + '/test1'
+    recorded = []
+    monkeypatch.setattr(tox_visits, 'recordVisit', lambda ix, path: recorded.append((ix, path)))
+    monkeypatch.chdir(root)
+    monkeypatch.setenv('PWD', root)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        assert main(['c1']) == 0
+        assert main(['-p', 'c1']) == 0
+    assert recorded == [(root + '/' + indexFileBase, root + '/a1/b1/c1')]
+
+
+def test_ranked_matches_lazy():
+    entries = [('%d' % n + 'x' * (n % 7), n % 3 + 1) for n in range(1000)]
+    mx = RankedMatches([entries])
+    assert len(mx) == 1000
+    assert mx[0:3] == sorted(entries, key=rankKey)[0:3]
+    assert len(mx._ranked) < 100  # only the top has been ranked
+    assert next(iter(mx)) == mx[0] and len(mx._ranked) < 100  # so does iterating
+    assert mx == sorted(entries, key=rankKey)  # ties keep their order
+    assert mx[-1] == sorted(entries, key=rankKey)[-1]
+
+
+def test_chain_matches_merged(tmp_path, monkeypatch):
+    import tox_core
+    (tmp_path / 'proj').mkdir()
+    (tmp_path / indexFileBase).write_text("proj/lib 1\nlib 1\nproj/src/lib 1\n")
+    (tmp_path / 'proj' / indexFileBase).write_text("#protect\nlib 1\nsrc/lib 1\nold/lib 3\n")
+    inner = str(tmp_path / 'proj')
+    monkeypatch.setenv('PWD', inner)
+    with TmpSwap(file_sys_root, str(tmp_path), set_file_sys_root):
+        ix = loadIndex(inner, True)
+        mx = ix.matchPaths(['lib'])
+        # Each dir once, at its best rank, inner index first on ties:
+        assert list(mx) == [('old/lib', 3), ('lib', 1), ('src/lib', 1), (str(tmp_path / 'lib'), 1)]
+        assert list(ix.matchPaths(['lib'], limit=2)) == list(mx)[:2]
+        monkeypatch.setattr(tox_core, 'maxChainDepth', 1)
+        assert len(loadIndex(inner, True).matchPaths(['lib'])) == 3
+
+
+def test_menu_pages_lazily(monkeypatch, capsys):
+    import tox_core
+    root = tox_core_root + '/test1'
+    keys = list('+3')
+    monkeypatch.setattr(tox_core, 'getraw_kbd', lambda: iter([keys.pop(0)]))
+    monkeypatch.setattr(tox_core, 'menuPageSize', lambda: 2)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        ix = loadIndex(root)
+        mx = ix.matchPaths(['*1'], True)
+        assert len(mx) == 7
+        _, chosen = promptMatchingEntry(mx, ix)
+    assert chosen == mx[3][0]
+    err = capsys.readouterr().err
+    assert '<More (5)>' in err and '<More (3)>' in err
+
+
+def test_prewarm_builds_sidecar_once(tmp_path, monkeypatch):
+    import fcntl
+    from zlib import crc32
+    import tox_cache
+    proj = tmp_path / 'proj'
+    proj.mkdir()
+    ixpath = str(proj / indexFileBase)
+    with open(ixpath, 'w') as f:
+        for n in range(tox_cache.cacheThreshold):
+            f.write("d%d 1\n" % n)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    with TmpSwap(file_sys_root, str(tmp_path), set_file_sys_root):
+        # While another prewarm holds the lock, we leave it alone:
+        lockpath = str(tmp_path / ('tox-%d-prewarm-%08x.lock' % (os.getuid(), crc32(ixpath.encode()))))
+        with open(lockpath, 'w') as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            assert main(['--prewarm', str(proj)]) == 0
+            assert not os.path.exists(tox_cache.cachePath(ixpath))
+        parsedIndexCache.pop(ixpath, None)
+        assert main(['--prewarm', str(proj)]) == 0
+        assert os.path.exists(tox_cache.cachePath(ixpath))
+        assert main(['--prewarm', str(tmp_path / 'nonesuch')]) == 1
+        # With the sidecar fresh (or the index small), there's nothing to do:
+        os.unlink(lockpath)  # The test's own
+        assert main(['--prewarm', str(proj)]) == 0
+        assert not os.path.exists(lockpath)
+        os.unlink(tox_cache.cachePath(ixpath))
+        parsedIndexCache.pop(ixpath, None)
+        assert main(['--prewarm', str(proj)]) == 0
+        assert os.stat(lockpath).st_mode & 0o777 == 0o600
+        # A symlink in place of the lock isn't followed (nor its target truncated):
+        os.unlink(lockpath)
+        (tmp_path / 'victim').write_text('keep')
+        os.symlink(str(tmp_path / 'victim'), lockpath)
+        os.unlink(tox_cache.cachePath(ixpath))
+        parsedIndexCache.pop(ixpath, None)
+        assert main(['--prewarm', str(proj)]) == 0
+        assert os.path.exists(tox_cache.cachePath(ixpath))  # Warmed unguarded
+        assert (tmp_path / 'victim').read_text() == 'keep'
+
+
+def _addMany(args):
+    ixpath, worker, count = args
+    for n in range(count):
+        ix = IndexContent(ixpath)  # A fresh `to -a` each time
+        ix.addDir('w%d/d%d' % (worker, n), worker + 1)
+        if n % 5 == 4:
+            ix.delDir('w%d/d%d' % (worker, n - 1))
+        ix.write()
+
+
+def test_parallel_adders_lose_nothing(tmp_path, monkeypatch):
+    import multiprocessing
+    import tox_core
+    monkeypatch.setattr(tox_core, 'journalCompactBytes', 500)
+    workers, count = 8, 20
+    expect = {('keep', 9)}
+    for w in range(workers):
+        expect |= {('w%d/d%d' % (w, n), w + 1) for n in range(count) if n % 5 != 3}
+    for journaled in (False, True):
+        ixpath = str(tmp_path / ('%s%d' % (indexFileBase, journaled)))
+        with open(ixpath, 'w') as f:
+            f.write("keep 9\n")
+        setJournaled(ixpath, journaled)
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            pool.map(_addMany, [(ixpath, w, count) for w in range(workers)])
+        assert set(IndexContent(ixpath)) == expect
+        assert len(IndexContent(ixpath)) == len(expect)
+    assert not [n for n in os.listdir(str(tmp_path)) if n.endswith('.tmp')]
+
+
+def test_journaled_index(tmp_path, monkeypatch):
+    import tox_core
+    ixpath = str(tmp_path / indexFileBase)
+    journal = ixpath + journalSuffix
+    with open(ixpath, 'w') as f:
+        f.write("a 1\nb 2\n")
+    setJournaled(ixpath, True)
+    ix = IndexContent(ixpath)
+    ix.addDir('c', 3)
+    ix.addDir('a', 5)
+    ix.delDir('b')
+    ix.write()
+    # Only the journal grew:
+    assert open(ixpath).read() == "a 1\nb 2\n"
+    assert open(journal).read() == "+c 3\n+a 5\n-b\n"
+    assert sorted(IndexContent(ixpath)) == [('a', 5), ('c', 3)]
+
+    # Other writers' appends are replayed too, and the journal compacts
+    # once it's big enough:
+    other = IndexContent(ixpath)
+    other.addDir('d', 1)
+    other.write()
+    monkeypatch.setattr(tox_core, 'journalCompactBytes', 10)
+    ix = IndexContent(ixpath)
+    ix.delDir('c')
+    ix.write()
+    assert open(ixpath).read() == "a 5\nd 1\n"
+    assert open(journal).read() == ""
+
+    # Export back to a plain index:
+    ix = IndexContent(ixpath)
+    ix.addDir('e', 1)
+    ix.write()
+    setJournaled(ixpath, False)
+    assert not os.path.exists(journal)
+    assert open(ixpath).read() == "a 5\nd 1\ne 1\n"
+
+
+def test_grep_auto_cache(tmp_path, monkeypatch, capsys):
+    import tox_auto
+    for d, tags, desc in (('a', 'web, db', 'Alpha'), ('b', 'db', 'Beta')):
+        (tmp_path / d).mkdir()
+        (tmp_path / d / '.tox-auto').write_text(f"# .TAGS: {tags}\n# .DESC: {desc}\n")
+    (tmp_path / 'c').mkdir()
+    (tmp_path / indexFileBase).write_text("a 1\nb 1\nc 1\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PWD', str(tmp_path))
+    root = str(tmp_path)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        assert main(['-g', 'Al']) == 0
+        assert capsys.readouterr().out == f"!{root}/a [.TAGS: web,db]  Alpha\n"
+        assert os.path.exists(root + '/' + indexFileBase + tox_auto.autoCacheSuffix)
+
+        # The cache answers without re-reading unchanged .tox-auto files:
+        reads = []
+        monkeypatch.setattr(tox_auto, 'readMeta', lambda d: reads.append(d) or tox_auto.NO_AUTO)
+        assert main(['-g', '--tag', 'db']) == 0
+        assert capsys.readouterr().out == f"!{root}/a [.TAGS: web,db]  Alpha\n{root}/b [.TAGS: db]  Beta\n"
+        assert main(['-g', '--tag', 'db', '--tag', 'web', 'a']) == 0
+        assert capsys.readouterr().out == f"!{root}/a [.TAGS: web,db]  Alpha\n"
+        assert reads == []
+        assert main(['-g', '(']) == 1
+
+
+def test_auto_harvest_parallel(tmp_path, monkeypatch):
+    import time
+    import tox_auto
+    from tox_walk import TimedOut
+    dirs = []
+    for n in range(6):
+        d = tmp_path / ('d%d' % n)
+        d.mkdir()
+        (d / '.tox-auto').write_text("# .TAGS: t%d\n# .DESC: dir %d\n" % (n, n))
+        dirs.append(str(d))
+    ixpath = str(tmp_path / indexFileBase)
+    cache = tox_auto.loadAutoCache(ixpath)
+    assert [m[2] for _, m, e in cache.harvest(dirs, 3)] == [' dir %d' % n for n in range(6)]
+    cache.save(dirs)
+    assert tox_auto.loadAutoCache(ixpath) is cache  # Reused until someone else saves
+
+    # A hung .tox-auto is abandoned, and its cached info used:
+    (tmp_path / 'd2' / '.tox-auto').write_text("# .DESC: changed\n")
+    slow = tox_auto.readMeta
+    monkeypatch.setattr(tox_auto, 'readMeta', lambda d: time.sleep(2) or slow(d))
+    start = time.monotonic()
+    got = list(cache.harvest(dirs, 3, 0.2, ordered=False))
+    assert time.monotonic() - start < 1.5
+    assert [d for d, _, _ in got][-1] == dirs[2]
+    d, meta, error = got[-1]
+    assert isinstance(error, TimedOut) and meta[2] == ' dir 2'
+
+
+def test_report(tmp_path, monkeypatch, capsys):
+    import json
+    import time
+    import tox_visits
+    for d, tags, desc in (('a', 'web, db', 'Alpha'), ('b', 'db', 'Beta')):
+        (tmp_path / d).mkdir()
+        (tmp_path / d / '.tox-auto').write_text(f"# .TAGS: {tags}\n# .DESC: {desc}\n")
+    (tmp_path / 'c').mkdir()
+    (tmp_path / indexFileBase).write_text("a 1\nb 3\nc 2\ngone 1\n")
+    root = str(tmp_path)
+    tox_visits.recordVisit(root + '/' + indexFileBase, root + '/b', 1e9)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PWD', root)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        assert main(['--report', 'ptde', '--sort', 'priority']) == 0
+        assert capsys.readouterr().out.split("\n") == [
+            f"!DIR{' ' * (len(root) + 4)}PRI  TAGS    DESC   EXISTS",
+            f"{root}/b     3    db      Beta   yes",
+            f"{root}/c     2                   yes",
+            f"{root}/a     1    web,db  Alpha  yes",
+            f"{root}/gone  1                   no",
+            ""]
+        assert main(['--report', 'v', '--format', 'tsv', '--tag', 'db', '--sort', 'visit']) == 0
+        assert capsys.readouterr().out == "!DIR\tVISITED\n%s/b\t%s\n%s/a\t-\n" % (
+            root, time.strftime("%Y-%m-%d %H:%M", time.localtime(1e9)), root)
+        assert main(['--report', 'tv', '--format', 'json', '--tag', 'web']) == 0
+        assert json.loads(capsys.readouterr().out[1:]) == [
+            {"dir": root + "/a", "tags": ["web", "db"], "visit": None}]
+        assert main(['--report', 'x']) == 1
+
+
+def test_compact_entries(tmp_path, monkeypatch):
+    import tox_core
+    import tox_cache
+    monkeypatch.setattr(tox_core, 'compactThreshold', 4)
+    monkeypatch.setattr(tox_cache, 'cacheThreshold', 4)
+    ixpath = str(tmp_path / indexFileBase)
+    entries = [('a/src', 1), ('b/src', 2), ('café', 1), ('d', 40000)]
+    with open(ixpath, 'w') as f:
+        f.writelines("%s %d\n" % e for e in entries)
+    for fromSidecar in (False, True):  # The first load writes the sidecar
+        parsedIndexCache.pop(ixpath, None)
+        ix = IndexContent(ixpath)
+        assert ix.compact is not None and not list.__len__(ix)
+        assert len(ix) == 4 and list(ix) == entries
+        assert ix[2] == ('café', 1) and ix[-1] == ('d', 40000) and ix[1:3] == entries[1:3]
+        root = str(tmp_path) + '/'
+        assert [e[0] for e in ix.matchPaths(['src'])] == [root + 'b/src', root + 'a/src']
+    assert ix.compact is not None and ix == entries and ('b/src', 2) in ix
+    assert ix.index(('café', 1)) == 2 and ix.count(('d', 40000)) == 1
+    assert ix.compact is None and ix.copy() == entries and repr(ix) == repr(entries)
+    ix.addDir('e', 1)
+    ix.delDir('a/src')
+    assert ix.compact is None
+    ix.write()
+    assert sorted(IndexContent(ixpath)) == entries[1:] + [('e', 1)]
+
+
+def test_multi_pattern_descends(tmp_path, monkeypatch, capsys):
+    import tox_core
+    root = str(tmp_path)
+    for d in ['proj/src', 'proj/lib/src2', 'other/src', 'src/proj/x', 'inner/src']:
+        (tmp_path / d).mkdir(parents=True)
+    (tmp_path / indexFileBase).write_text(
+        'proj\nproj/src\nproj/lib\nproj/lib/src2\nother/src\nsrc/proj\nsrc/proj/x\ninner\n')
+    (tmp_path / 'inner' / indexFileBase).write_text('src\n')
+    loads = []
+    realLoad = tox_core.loadIndex
+    def countingLoad(*args):
+        loads.append(args[0])
+        return realLoad(*args)
+    monkeypatch.setattr(tox_core, 'loadIndex', countingLoad)
+    monkeypatch.chdir(root)
+    monkeypatch.setenv('PWD', root)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        # 'src' only below proj, and not matching on proj's own path:
+        assert main(['-p', 'proj', '0', 'src']) == 0
+        assert capsys.readouterr().out == '!proj/src\nproj/lib/src2\n'
+        assert loads == [root] and os.getcwd() == root
+        # inner has its own index, so that one is loaded:
+        assert main(['-p', 'inner', '0', 'src']) == 0
+        assert capsys.readouterr().out == '!%s/inner/src\n' % root
+        assert loads[1:] == [root, root + '/inner']
+
+
+def test_multi_pattern_after_menu(tmp_path, monkeypatch, capsys):
+    import tox_core
+    import tox_cache
+    real = tmp_path / 'real'
+    (real / 'proj' / 'src').mkdir(parents=True)
+    (real / 'proj2' / 'src').mkdir(parents=True)
+    (tmp_path / 'link').symlink_to(real)
+    with open(str(real / indexFileBase), 'w') as f:
+        f.write('proj\nproj/src\nproj2\nproj2/src\n')
+        f.writelines('pad/d%d\n' % n for n in range(tox_cache.cacheThreshold))
+    monkeypatch.setattr(tox_core, 'incrementalMenu', False)
+    monkeypatch.setattr(tox_core, 'menuPageSize', lambda: 5)
+    for root in [str(real), str(tmp_path / 'link')]:  # The first writes the sidecar
+        parsedIndexCache.clear()
+        monkeypatch.chdir(root)
+        monkeypatch.setenv('PWD', root)
+        with TmpSwap(file_sys_root, str(tmp_path), set_file_sys_root):
+            # The menu hands back a path relative to the index root:
+            monkeypatch.setattr(tox_core, 'getraw_kbd', lambda: iter('0'))
+            assert main(['proj', 'src']) == 0
+            assert capsys.readouterr().out == root + '/proj/src\n'
+            assert main(['-p', 'proj2', '0', 'src']) == 0
+            assert capsys.readouterr().out == '!proj2/src\n'
+        assert os.path.exists(tox_cache.cachePath(str(real / indexFileBase)))
+
+
+def test_fuzzy_match(tmp_path, monkeypatch, capsys):
+    import tox_core
+    from tox_fuzzy import FuzzyQuery, charMask, estimate, pathMasks, score
+    assert score('src', 'proj/src') > score('src', 'proj/sxrxc') > 0
+    assert score('tc', 'tox_core') > score('tc', 'xtxc')
+    assert score('src', 'crs') is None
+    paths = ['lib/Src', 'a/s/r/c', 'sr', 'doc/scratch']
+    masks = pathMasks(paths)
+    assert masks[0] == charMask('/libsrc')
+    assert sorted(FuzzyQuery('SRC').match(paths.__getitem__, masks)) == [
+        (0, score('src', 'lib/Src')), (1, score('src', 'a/s/r/c')), (3, score('src', 'doc/scratch'))]
+    # Past the limit, only the tightest matches are scored in full:
+    assert sorted(FuzzyQuery('src').match(paths.__getitem__, masks, limit=1)) == [
+        (0, score('src', 'lib/Src')), (1, estimate('src', 5)), (3, estimate('src', 6))]
+
+    root = str(tmp_path)
+    monkeypatch.setattr(tox_core, 'fuzzyMatching', False)  # main() sets it
+    (tmp_path / indexFileBase).write_text('doc/scratch 1\nlib/src 1\nsrcs/a/b/c/d 1\nnotes 3\n')
+    monkeypatch.chdir(root)
+    monkeypatch.setenv('PWD', root)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        assert main(['-p', '-z', 'src']) == 0
+        assert capsys.readouterr().out == '!lib/src\nsrcs/a/b/c/d\ndoc/scratch\n'
+        monkeypatch.setenv('tox_fuzzy', '1')
+        assert main(['-p', 'nts']) == 0
+        assert capsys.readouterr().out == '!notes\n'
+        monkeypatch.setattr(tox_core, 'fuzzyMatching', False)
+        assert main(['nts']) == 0  # No options: skips argparse, not $tox_fuzzy
+        assert capsys.readouterr().out == root + '/notes\n'
+
+
+def test_live_menu_narrows(tmp_path, monkeypatch, capsys):
+    import io
+    import tox_core
+    import tox_live
+    looked = []
+    def source():
+        for n in range(10 ** 6):
+            looked.append(n)
+            yield ('d%d' % n, ('d%d' % n, 1))
+    out = io.StringIO()
+    render = lambda item, selected: ('>' if selected else ' ') + item[0]
+    menu = tox_live.LiveMenu(source(), 3, lambda t: lambda item: t in item[0], render, out)
+    menu.draw()
+    assert out.getvalue().split('\r\n')[:3] == ['>d0', ' d1', ' d2']
+    for c in '99':
+        assert menu.key(c) is None
+    assert menu.shown[:3] == ['>d99', ' d199', ' d299']
+    assert len(looked) <= 2 * tox_live.scanBudget  # However big the source
+    out.seek(0)
+    out.truncate()
+    for c in '\033[B':  # Down: only the two rows whose marker moved are redrawn
+        menu.key(c)
+    assert menu.cursor == 1 and out.getvalue().count('A\r\033[K') == 2
+    menu.key('\177')
+    assert menu.query == '9' and menu.key('\r') == ('d9', ('d9', 1))
+
+    # Fed by RankedMatches, after rankAhead() a keystroke ranks no more than
+    # it looks at, however many the matches:
+    ranked = []
+    def key(entry):
+        ranked.append(entry)
+        return rankKey(entry)
+    mx = RankedMatches([[('e%d' % n, 1 + n % 3) for n in range(10 ** 5)]], key=key)
+    mx.rankAhead()
+    menu = tox_live.LiveMenu(((e[0], e) for e in mx), 3, lambda t: lambda item: t in item[0],
+                             render, io.StringIO())
+    menu.draw()
+    del ranked[:]
+    menu.key('#')  # Matches nothing, so it looks as far as it may
+    assert menu.view()[-1].endswith('(0+):\033[;0m #')
+    assert len(ranked) <= tox_live.scanBudget + 1
+
+    root = str(tmp_path)
+    (tmp_path / indexFileBase).write_text('src/a\nsrc/b\nsrc/zz\n')
+    monkeypatch.setattr(tox_core, 'incrementalMenu', False)  # main() sets it
+    monkeypatch.setattr(tox_core, 'getraw_kbd', lambda: iter('zz\r'))
+    monkeypatch.setattr(tox_core, 'menuPageSize', lambda: 5)
+    monkeypatch.chdir(root)
+    monkeypatch.setenv('PWD', root)
+    with TmpSwap(file_sys_root, root, set_file_sys_root):
+        assert main(['-i', 'src']) == 0
+        assert capsys.readouterr().out == 'src/zz\n'
+        monkeypatch.setenv('tox_incremental', '1')
+        monkeypatch.setattr(tox_core, 'incrementalMenu', False)
+        monkeypatch.setattr(tox_core, 'getraw_kbd', lambda: iter('b\r'))
+        assert main(['src']) == 0
+        assert capsys.readouterr().out == 'src/b\n'
+
+
+def test_indexedset_bulk():
+    import pytest
+    from setutils import IndexedSet, CompactIndexedSet
+    s = IndexedSet([3, 1, 3, 2, 1])
+    assert list(s) == [3, 1, 2] and s.index(2) == 2
+    s.discard(1)  # Leaves a dead slot for the bulk ops to cope with
+    s.update_many([5, 3, 6], iter([7, 5]))
+    assert list(s) == [3, 2, 5, 6, 7] and s[2] == 5
+    s.discard_many([2, 99], (7,))
+    assert list(s) == [3, 5, 6] and s[-1] == 6 and s.index(6) == 2
+    with pytest.raises(KeyError):
+        s.remove_many([3, 42])
+    assert list(s) == [3, 5, 6]  # Nothing removed
+    s.remove_many(iter([3, 6]))
+    assert list(s) == [5]
+    c = CompactIndexedSet('abca')
+    assert not hasattr(c, '__dict__') and c == IndexedSet('abc') and c[1:] == IndexedSet('bc')
+
+
 if __name__ == "__main__":
 
     test_2()
@@ -22,6 +22,8 @@ if [[ -f ${TOXHOME}/tox_core.py ]]; then
             return
         fi
         pushd "$newDir" >/dev/null
+        # Get the index chain here loaded before our first lookup in it:
+        ( $ToxPython $TOXHOME/tox_core.py --prewarm "$newDir" </dev/null &>/dev/null & )
         if [[ -f ./.tox-auto ]]; then
             # Before we source this, we want to figure out if it's a null operation, otherwise we'll
             # print a meaningless sourcing message.
@@ -56,6 +58,12 @@ if [[ -f ${TOXHOME}/tox_core.py ]]; then
         fi
         set +f
     }
+    function tox_serve {
+        # Start the resident tox server (see tox_daemon.py) in the background.
+        # Once it's listening, tox_core.py forwards each call to it instead of
+        # loading everything from scratch.
+        ( $ToxPython $TOXHOME/tox_core.py --serve </dev/null &>/dev/null & )
+    }
     [[ -f $HOME/.tox-index ]] || ( touch $HOME/.tox-index &>/dev/null )
     alias to='set -f;tox_w'
     alias toa='set -f; tox_w -a'
@@ -85,15 +93,11 @@ fi
 
 _tox()  # Here's our readline completion handler
 {
-    COMPREPLY=()
-    local cur="${COMP_WORDS[COMP_CWORD]}"
-
-    # Extract the path of the index file:
-    local toxfile=$(tox -q 2>&1 | egrep -m 1 '^Index' | awk '{print $2'})
-
-    local opts="$(egrep -v '^#protect' ${toxfile} )"
-
-    COMPREPLY=( $(compgen -W "${opts}" -- ${cur}) )
+    # One call, which prints the index path fragments (across the whole
+    # index chain) starting with the word being completed.  -S: skip the
+    # site-packages setup, tox only needs the standard library.
+    local IFS=$'\n'
+    COMPREPLY=( $( $ToxPython -S $TOXHOME/tox_complete.py "${COMP_WORDS[COMP_CWORD]}" 2>/dev/null ) )
     return 0
 }
 
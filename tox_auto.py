@@ -0,0 +1,191 @@
+# tox_auto.py
+''' .tox-auto metadata, and a per-index cache of it.
+
+    `to -g` used to re-read and re-parse the .tox-auto of every indexed dir
+    on each call.  AutoCache keeps the .TAGS/.DESC/.GREPAT values of each
+    dir in <index>.auto, and only re-reads a .tox-auto whose mtime has
+    changed (one stat per dir).  Tag filters check the tags of each record
+    as it's harvested: a tag -> dirs index would save nothing, as every dir
+    still needs its stat to tell whether its tags changed.  Failing to save
+    the cache is silently ignored.
+
+    Over NFS even the stats add up, so AutoCache.harvest() does them (and
+    any re-reads) on a bounded pool of threads, abandoning the ones which
+    take too long. '''
+from __future__ import annotations
+import os
+import marshal
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+autoFileName:str = ".tox-auto"
+autoCacheSuffix:str = ".auto"
+CACHE_VERSION = 1
+
+
+class AutoContent(list):
+    """ Reader/parser of the .tox-auto files """
+
+    def __init__(self, path):
+        self.path = path
+        self.tagsLoc = None
+        self.descLoc = None
+        self.grepatLoc = None
+        if path:
+            with open(path, "r") as f:
+                self.extend(f.readlines())
+
+        lineNdx = 0
+        for line in self:
+
+            # Locate the .TAGS, .DESC and .GREPAT content:
+            if not self.tagsLoc and line.startswith("# .TAGS:"):
+                self.tagsLoc = (lineNdx, 8)
+            elif not self.descLoc and line.startswith("# .DESC:"):
+                self.descLoc = (lineNdx, 8)
+            elif not self.grepatLoc and line.startswith("# .GREPAT:"):
+                self.grepatLoc = (lineNdx, 10)
+
+            lineNdx += 1
+
+    def tags(self):
+        """ Return the value of .TAGS as array of strings.  Tags are
+        separated by commas and/or whitespace. """
+        if not self.tagsLoc:
+            return []
+        raw = self[self.tagsLoc[0]][self.tagsLoc[1] :]
+        return raw.replace(",", " ").split()
+
+    def desc(self):
+        """ Return the value of .DESC as a string """
+        if self.descLoc is None:
+            return ""
+        return self[self.descLoc[0]][self.descLoc[1] :].rstrip()
+
+    def grepat(self):
+        """ Return the value of .GREPAT as a string """
+        if self.grepatLoc is None:
+            return ""
+        return self[self.grepatLoc[0]][self.grepatLoc[1] :].strip()
+
+
+# A dir's metadata: (mtime_ns of its .tox-auto, tags, desc, grepat).  Dirs
+# without a .tox-auto have NO_AUTO.
+NO_AUTO = (-1, (), "", "")
+
+
+def readMeta(dir:str) -> tuple:
+    """ Current metadata of dir, read from its .tox-auto """
+    path = "/".join([dir, autoFileName])
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        cnt = AutoContent(path)
+    except (OSError, UnicodeDecodeError):
+        return NO_AUTO
+    return (mtime, tuple(cnt.tags()), cnt.desc(), cnt.grepat())
+
+
+def freshMeta(dir:str, cached:Optional[tuple]) -> tuple:
+    """ Metadata of dir: 'cached' if its .tox-auto hasn't changed since,
+    else read anew.  Safe to call from any thread. """
+    try:
+        mtime = os.stat("/".join([dir, autoFileName])).st_mtime_ns
+    except OSError:
+        mtime = -1
+    if cached is not None and cached[0] == mtime:
+        return cached
+    return readMeta(dir) if mtime >= 0 else NO_AUTO
+
+
+def renderMeta(dir:str, meta:tuple) -> str:
+    """ The `to -g` line for dir """
+    if meta[0] < 0:
+        return dir
+    return "%s [.TAGS: %s] %s" % (dir, ",".join(meta[1]), meta[2])
+
+
+class AutoCache(object):
+    ''' Metadata of the dirs of one index, as of the last time each one's
+    .tox-auto was looked at '''
+    def __init__(self, indexPath:str):
+        self.path = indexPath + autoCacheSuffix
+        self.records:Dict[str,tuple] = {}
+        self.dirty = False
+        self.mtime = -1  # Of the file, as we loaded or saved it
+        try:
+            with open(self.path, "rb") as f:
+                self.mtime = os.fstat(f.fileno()).st_mtime_ns
+                version, records = marshal.load(f)
+            if version == CACHE_VERSION:
+                self.records = records
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    def meta(self, dir:str) -> tuple:
+        """ Metadata of dir, re-read only if its .tox-auto changed """
+        return self.update(dir, freshMeta(dir, self.records.get(dir)))
+
+    def update(self, dir:str, meta:tuple) -> tuple:
+        if self.records.get(dir) is not meta:
+            self.records[dir] = meta
+            self.dirty = True
+        return meta
+
+    def harvest(self, dirs:Sequence[str], workers:int=None, timeout:float=None,
+                ordered:bool=True) -> Iterator[Tuple[str,tuple,BaseException]]:
+        """ Yield (dir, metadata, error) for each of 'dirs', checking them on
+        a bounded pool of threads, in order or as they complete.  Checks that
+        fail or take longer than 'timeout' seconds (see tox_walk.chunkedMap)
+        yield the cached metadata (NO_AUTO if none) along with the error. """
+        from tox_walk import chunkedMap
+        records = self.records
+        def check(dir:str) -> tuple:
+            return freshMeta(dir, records.get(dir))
+        for dir, meta, error in chunkedMap(check, dirs, workers, timeout, ordered):
+            if error is None:
+                self.update(dir, meta)
+            else:
+                meta = records.get(dir, NO_AUTO)
+            yield dir, meta, error
+
+    def save(self, dirs:Iterable[str]=None) -> bool:
+        """ Persist the cache if anything changed, keeping only 'dirs' if
+        given (i.e. forgetting dirs no longer in the index) """
+        if dirs is not None:
+            keep = set(dirs)
+            if len(keep) != len(self.records) or not keep.issuperset(self.records):
+                self.records = {d: m for d, m in self.records.items() if d in keep}
+                self.dirty = True
+        if not self.dirty:
+            return True
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                marshal.dump((CACHE_VERSION, self.records), f)
+            os.replace(tmp, self.path)
+            self.mtime = os.stat(self.path).st_mtime_ns
+            self.dirty = False
+            return True
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+
+
+autoCaches:Dict[str,"AutoCache"] = {}
+
+
+def loadAutoCache(indexPath:str) -> "AutoCache":
+    """ The AutoCache of indexPath, reusing the one this process already has
+    unless another process saved a newer one since """
+    try:
+        mtime = os.stat(indexPath + autoCacheSuffix).st_mtime_ns
+    except OSError:
+        mtime = -1
+    cache = autoCaches.get(indexPath)
+    if cache is None or cache.mtime != mtime:
+        cache = autoCaches[indexPath] = AutoCache(indexPath)
+    return cache
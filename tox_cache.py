@@ -0,0 +1,197 @@
+# tox_cache.py
+''' Pre-parsed binary sidecar for large .tox-index files.
+
+    The sidecar (<index>.cache) holds the parsed entries, their priorities,
+    the fragment index (tox_fragindex.py) over the pre-split path fragments
+    and the entries' tox_fuzzy masks, plus the signature (mtime/size/inode,
+    and journal size) of the text index it was built from.  It's
+    memory-mapped on load and only trusted while that signature matches;
+    otherwise the caller re-parses the text and rebuilds it.  Failing to write
+    the sidecar (e.g. read-only shared trees) is silently ignored.  It holds
+    no absolute paths: an index reached through a symlink would need other
+    ones than whoever wrote the sidecar.
+
+    Very large indices keep their entries as CompactEntries rather than a
+    tuple per entry: backed by the sidecar's mapping, they cost next to no
+    private memory however many processes load them. '''
+from __future__ import annotations
+import os
+import sys
+import mmap
+import struct
+from array import array
+from itertools import accumulate
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Optional, Sequence
+from tox_fragindex import FragmentIndex
+from tox_fuzzy import pathMasks
+
+cacheSuffix:str = ".cache"
+cacheThreshold:int = 512  # Indices smaller than this aren't worth a sidecar
+
+MAGIC = b"TOXC"
+VERSION = 6
+# magic, version, little-endian flag, mtime_ns, size, inode, journal size,
+# entry count, fuzzy mask count (the same),
+# fragment count, fragment postings, trigram count, trigram postings, then
+# byte lengths of the 3 text blobs (paths, fragments, trigrams), and padding.
+# The arrays follow: fuzzy masks (first, as the header's size keeps them
+# 8-byte aligned), priorities, path offsets into the first blob, then the
+# fragment index's.
+HEADER = struct.Struct("<4sHHqqQqIIIIIIIII4x")
+LITTLE = 1 if sys.byteorder == "little" else 0
+
+
+def cachePath(indexPath:str) -> str:
+    return indexPath + cacheSuffix
+
+
+class IndexCache(object):
+    ''' Read-only view of a sidecar file.  Arrays are memoryviews into the
+    mapping; strings are only decoded when asked for. '''
+    def __init__(self, mm:mmap.mmap, header:tuple):
+        (_, _, _, _, _, _, _, self.count, nmasks, self.nfrags, npost, self.ntri, ntripost,
+         *blobLengths) = header
+        self._mm = mm
+        view = memoryview(mm)
+        ofs = HEADER.size
+        def take(n:int, fmt:str):
+            nonlocal ofs
+            size = struct.calcsize(fmt)
+            v = view[ofs:ofs + n * size].cast(fmt)
+            ofs += n * size
+            return v
+        self.fuzzyMasks = take(nmasks, "Q")
+        self.priorities = take(self.count, "i")
+        self.pathOffsets = take(self.count + 1, "I")
+        self.postOffsets = take(self.nfrags + 1, "I")
+        self.postings = take(npost, "I")
+        self.triOffsets = take(self.ntri + 1, "I")
+        self.triPostings = take(ntripost, "I")
+        self._blobs = []
+        for n in blobLengths:
+            self._blobs.append((ofs, ofs + n))
+            ofs += n
+
+    def _strings(self, which:int, expect:int) -> List[str]:
+        a, b = self._blobs[which]
+        if a == b:
+            # Nothing, or a single empty string:
+            return [""] * min(1, expect)
+        return self._mm[a:b].decode("utf-8").split("\n")
+
+    def entries(self) -> tuple:
+        """ (path,priority) tuples, same as parsing the text index """
+        return tuple(zip(self._strings(0, self.count), self.priorities.tolist()))
+
+    def compactEntries(self) -> CompactEntries:
+        """ The entries, still in the mapping """
+        a, b = self._blobs[0]
+        return CompactEntries(memoryview(self._mm)[a:b], self.pathOffsets, self.priorities)
+
+    def fragmentIndex(self) -> FragmentIndex:
+        """ The persisted fragment index, its arrays still backed by the mapping """
+        return FragmentIndex(self._strings(1, self.nfrags), self.postOffsets, self.postings,
+                             self._strings(2, self.ntri), self.triOffsets, self.triPostings)
+
+
+class CompactEntries(object):
+    ''' Read-only sequence of (path,priority) tuples, made only as they're
+    read.  The paths are one '\n' separated UTF-8 buffer, path n starting at
+    byte offsets[n], and the priorities an array. '''
+    def __init__(self, blob, offsets:Sequence[int], priorities:Sequence[int]):
+        self.blob = blob
+        self.offsets = offsets
+        self.priorities = priorities
+
+    @classmethod
+    def build(cls, entries:Sequence[tuple]) -> "CompactEntries":
+        paths = [e[0] for e in entries]
+        blob = "\n".join(paths).encode("utf-8")
+        try:
+            priorities = array("h", [e[1] for e in entries])
+        except OverflowError:
+            priorities = array("i", [e[1] for e in entries])
+        return cls(blob, pathOffsets(paths, blob), priorities)
+
+    def __len__(self) -> int:
+        return len(self.priorities)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        priority = self.priorities[n]
+        if n < 0:
+            n += len(self)
+        return (str(self.blob[self.offsets[n]:self.offsets[n + 1] - 1], "utf-8"), priority)
+
+    def __iter__(self):
+        if not len(self):
+            return iter(())
+        return zip(str(self.blob, "utf-8").split("\n"), self.priorities)
+
+
+def pathOffsets(paths:List[str], blob:bytes) -> array:
+    """ Where each of 'paths' starts in blob, their '\n' separated UTF-8 """
+    lengths = map(len, paths) if len(blob) == len(paths) - 1 + sum(map(len, paths)) else \
+        (len(p.encode("utf-8")) for p in paths)
+    offsets = array("I", [0])
+    offsets.extend(accumulate(map((1).__add__, lengths)))
+    return offsets
+
+
+def loadCache(indexPath:str, sig:tuple) -> Optional[IndexCache]:
+    """ Map the sidecar for indexPath if it exists and matches 'sig' """
+    try:
+        with open(cachePath(indexPath), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        header = HEADER.unpack_from(mm, 0)
+    except struct.error:
+        mm.close()
+        return None
+    magic, version, little = header[:3]
+    if (magic, version, little) != (MAGIC, VERSION, LITTLE) or header[3:7] != sig:
+        mm.close()
+        return None
+    return IndexCache(mm, header)
+
+
+def writeCache(indexPath:str, sig:tuple, entries:tuple, fx:FragmentIndex=None, masks:Sequence[int]=None) -> bool:
+    """ Atomically (re)build the sidecar for indexPath, using the fragment
+    index 'fx' and fuzzy masks if the caller already has them.  Returns
+    False if it couldn't be written, which callers may ignore. """
+    if len(entries) < cacheThreshold:
+        return False
+    paths = [e[0] for e in entries]
+    if fx is None:
+        fx = FragmentIndex.build(paths)
+    if masks is None:
+        masks = pathMasks(paths)
+    blobs = ["\n".join(x).encode("utf-8") for x in (paths, fx.frags, fx.triKeys)]
+    header = HEADER.pack(MAGIC, VERSION, LITTLE, *sig,
+                         len(entries), len(masks), len(fx.frags), len(fx.postings),
+                         len(fx.triKeys), len(fx.triPostings), *[len(b) for b in blobs])
+    target = cachePath(indexPath)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(header)
+            (masks if isinstance(masks, array) else array("Q", masks)).tofile(f)
+            array("i", [e[1] for e in entries]).tofile(f)
+            pathOffsets(paths, blobs[0]).tofile(f)
+            for a in (fx.postOffsets, fx.postings, fx.triOffsets, fx.triPostings):
+                a.tofile(f)
+            for b in blobs:
+                f.write(b)
+        os.replace(tmp, target)
+        return True
+    except (OSError, OverflowError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,13 @@
+# tox_complete.py
+''' Shell completion entry point: `tox_complete.py <prefix>` prints the same
+as `tox_core.py --complete <prefix>`, only sooner.  Python never caches
+the bytecode of the script it's asked to run, and compiling tox_core.py
+takes longer than completing a word, so this stub imports it instead.
+
+It doesn't go through a --serve daemon: with the index's binary sidecar,
+completing in-process is quicker than the round trip. '''
+import sys
+import tox_core
+
+if __name__ == "__main__":
+    sys.exit(tox_core.main(["--complete"] + sys.argv[1:2]))
@@ -1,21 +1,49 @@
 # tox_core.py
+from __future__ import annotations
 import os
 import sys
-import tty
-import termios
-from typing import Callable, List, Dict, Tuple
+
+if __name__ == "__main__" and "--serve" not in sys.argv[1:]:
+    # If a resident server (tox_core.py --serve) is listening, let it answer
+    # and skip the rest of our startup entirely:
+    import tox_daemon
+    _status = tox_daemon.forward(sys.argv[1:])
+    if _status is not None:
+        sys.exit(_status)
+
+TYPE_CHECKING = False  # typing costs a lot of startup time for annotations only
+if TYPE_CHECKING:
+    from typing import Callable, List, Dict, Iterable, Iterator, Sequence, Tuple
 from collections import OrderedDict
 
-import logging
-logging.basicConfig(filename=f"{os.environ.get('HOME','/tmp')}/.tox_core.log",
+
+# Logging is opt-in: set tox_log=1 to append to ~/.tox_core.log, or
+# tox_log=<file> to log elsewhere.  The logging module isn't even imported
+# otherwise.  tox_log is read on every call, since a --serve worker adopts
+# its client's environment long after import.
+logTarget:str = None  # What logger was set up for
+logger = None
+
+def log(msg:str) -> None:
+    global logger, logTarget
+    target = os.environ.get('tox_log', '')
+    if target in ('', '0'):
+        return
+    if logger is None or target != logTarget:
+        import logging
+        logging.basicConfig(filename=f"{os.environ.get('HOME','/tmp')}/.tox_core.log" if target == '1' else target,
                             filemode='a',
                             format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
                             datefmt='%H:%M:%S',
-                            level=logging.DEBUG)
+                            level=logging.DEBUG,
+                            force=True)
+        logger = logging.getLogger('tox')
+        logTarget = target
+    logger.info(msg)
 
 
 tox_core_root = os.path.dirname(os.path.realpath(__file__))
-logging.info(f"tox startup, args={sys.argv}, cwd={os.getcwd()}, __file__={__file__}")
+log(f"tox startup, args={sys.argv}, cwd={os.getcwd()}, __file__={__file__}")
 
 sys.path.insert(0, tox_core_root)
 
@@ -31,17 +59,19 @@ if int(os.environ.get('tox_debugpy',0)) > 0:
     if int(os.environ.get('break_on_main',0)) < 1:
         breakpoint()
 
-from io import StringIO
-import re
+# Only what a plain lookup needs is imported here; everything else (argparse,
+# the tox_walk thread pools, terminal handling...) is imported where it's used.
+# bench/bench_startup.py keeps an eye on this.
 import bisect
-import argparse
-import fnmatch
-import shutil
-from subprocess import call
+import functools
+import heapq
+import time
 from os.path import dirname, isdir, realpath, exists, isfile
 from os import getcwd, environ, stat
 from pwd import getpwuid
-from setutils import IndexedSet
+import tox_cache
+import tox_visits
+from tox_fragindex import FragmentIndex
 
 
 toxRootKey:str = "ToxSysRoot"
@@ -68,11 +98,21 @@ class UserDownTrap(UserTrap):
     ...
 class UserSelectionTrap(UserTrap):
     ...
+class UserMoreTrap(UserTrap):
+    ...
 
 class AddEntryAlreadyPresent(BaseException):
     ...
 
 indexFileBase:str = ".tox-index"
+lockSuffix:str = ".lock"  # <index>.lock serializes writers
+journalSuffix:str = ".journal"  # Edits not yet in <index>, if it's journaled
+journalCompactBytes:int = 64 * 1024  # Or a quarter of the index, if that's more
+maxChainDepth:int = None  # Most indices a deep search loads, None for all
+completeLimit:int = int(os.environ.get('tox_complete_max') or 50)  # Max candidates per Tab
+compactThreshold:int = 100000  # Indices this big keep tox_cache.CompactEntries, not tuples
+fuzzyMatching:bool = False  # Match lookups with tox_fuzzy rather than globs: -z, or tox_fuzzy=1
+incrementalMenu:bool = False  # Choose with tox_live's filtering menu: -i, or tox_incremental=1
 
 home_path:str=os.environ.get('HOME',None)
 
@@ -99,6 +139,8 @@ def pwd() -> str:
     return environ.get("PWD", getcwd())
 
 def getraw_kbd() -> str:
+    import tty
+    import termios
     fd = sys.stdin.fileno()
     old_settings = termios.tcgetattr(fd)
     try:
@@ -118,25 +160,183 @@ def trace(msg: str) -> None:
     sys.stderr.write(f"\033[;33m{msg}\033[;0m\n")
 
 
+class ParsedIndex(object):
+    ''' The parsed content of one index file as of signature 'sig'.  It's shared
+    (read-only) by every IndexContent loaded from that file, so anything derived
+    from the entries, like the fragment index, is only built once. '''
+    def __init__(self, sig:tuple, entries:tuple, sidecar=None):
+        self.sig = sig
+        self._entries = entries
+        self.sidecar = sidecar
+        self._fragments = None
+        self._trie = None
+        self._masks = None
+        self._paths = None
+
+    @property
+    def entries(self) -> Sequence[Tuple[str,int]]:
+        """ Decoded from the sidecar on first use: completion never needs them.
+        A tuple, or CompactEntries for very large indices. """
+        if self._entries is None:
+            if self.sidecar.count >= compactThreshold:
+                self._entries = self.sidecar.compactEntries()
+            else:
+                self._entries = self.sidecar.entries()
+        return self._entries
+
+    def fragmentIndex(self) -> FragmentIndex:
+        if self._fragments is None:
+            if self.sidecar is not None:
+                self._fragments = self.sidecar.fragmentIndex()
+            else:
+                self._fragments = FragmentIndex.build([e[0] for e in self.entries])
+        return self._fragments
+
+    def pathTrie(self, root:str) -> "tox_trie.PathTrie":
+        """ Trie of the entries' absolute paths, those relative being to 'root' """
+        if self._trie is None:
+            from tox_trie import PathTrie
+            paths = [e[0] if e[0][0] == "/" else "/".join([root, e[0]]) for e in self.entries]
+            self._trie = PathTrie.build(paths)
+        return self._trie
+
+    def fuzzyMasks(self) -> Sequence[int]:
+        if self._masks is None:
+            if self.sidecar is not None:
+                self._masks = self.sidecar.fuzzyMasks
+            else:
+                from tox_fuzzy import pathMasks
+                self._masks = pathMasks(e[0] for e in self.entries)
+        return self._masks
+
+    def hasPath(self, path:str) -> bool:
+        """ Is 'path', as written in the index, one of our entries? """
+        if self._paths is None:
+            self._paths = frozenset(e[0] for e in self.entries)
+        return path in self._paths
+
+
+# Parsed index files, keyed by path, only reused while the file's signature is
+# unchanged.  This pays off when the same process loads an index repeatedly,
+# e.g. in the --serve daemon.
+parsedIndexCache:Dict[str,ParsedIndex] = {}
+
+def indexSignature(path:str) -> tuple:
+    """ Identify the current content of an index file without reading it:
+    its mtime, size and inode, and the size of its journal (-1 if none) """
+    st = stat(path)
+    try:
+        journal = stat(path + journalSuffix).st_size
+    except FileNotFoundError:
+        journal = -1
+    return (st.st_mtime_ns, st.st_size, st.st_ino, journal)
+
+def parseLine(line:str) -> Tuple[str,int]:
+    """ (path, priority) of an index line, path is empty for non-entries """
+    xpath,_,priority=line.rstrip().partition(' ')
+    if not xpath or xpath[0]=='#':
+        return ("", 0)
+    try:
+        pri=int(priority)
+    except:
+        pri=1
+    return (xpath,pri)
+
+def replayJournal(entries:List[Tuple[str,int]], path:str, size:int) -> tuple:
+    """ Apply the '+path pri' and '-path' records in the first 'size' bytes
+    of journal 'path' to entries.  Reading no more than the signature says
+    keeps what we parse consistent with it, even if a writer appends now. """
+    merged = dict(entries)
+    with open(path, "rb") as f:
+        records = f.read(size).decode()
+    for line in records.split("\n")[:-1]:  # The last one is unfinished, or empty
+        if line[:1] == '+':
+            xpath,pri = parseLine(line[1:])
+            if xpath:
+                merged[xpath] = pri
+        elif line[:1] == '-':
+            merged.pop(line[1:], None)
+    return tuple(merged.items())
+
+def parseIndexFile(path:str) -> ParsedIndex:
+    """ Return the parsed content of index file 'path', reading the text only
+    if our cached copy and its binary sidecar are missing or stale """
+    sig = indexSignature(path)
+    hit = parsedIndexCache.get(path)
+    if hit is not None and hit.sig == sig:
+        return hit
+    sidecar = tox_cache.loadCache(path, sig)
+    if sidecar is not None:
+        parsed = ParsedIndex(sig, None, sidecar)
+        parsedIndexCache[path] = parsed
+        return parsed
+    entries = []
+    with open(path, "r") as f:
+        for line in f.readlines():
+            entry = parseLine(line)
+            if entry[0]:
+                entries.append(entry)
+    if sig[3] >= 0:
+        entries = replayJournal(entries, path + journalSuffix, sig[3])
+        if indexSignature(path)[:3] != sig[:3]:
+            # Compacted while we read: the journal we replayed may not be
+            # the one that goes with the index file we read
+            return parseIndexFile(path)
+    if len(entries) >= compactThreshold:
+        entries = tox_cache.CompactEntries.build(entries)
+    else:
+        entries = tuple(entries)
+    parsed = ParsedIndex(sig, entries)
+    parsedIndexCache[path] = parsed
+    if len(entries) >= tox_cache.cacheThreshold:
+        tox_cache.writeCache(path, sig, parsed.entries, parsed.fragmentIndex(), parsed.fuzzyMasks())
+    return parsed
+
+
 class IndexContent(list):
     ''' Each index entry is a [path,priority] tuple.  Higher priority numbers cause
     an entry to move to the top of the match list.  Default priority is 1.  Absent
-    priority, entries or ordered by ascending length alone. '''
+    priority, entries or ordered by ascending length alone.
+
+    A very large index leaves its entries in their compact parsed form
+    (self.compact, read through the overrides below) until it's edited,
+    when they're copied into the list proper.  Any other list method
+    unpacks them first (see _unpackFirst). '''
     def __init__(self, path: str):
         self.path: str = path
         self.protect: bool = False
         self.outer = None  # If we are chaining indices
 
-        with open(self.path, "r") as f:
-            for line in f.readlines():
-                path,_,priority=line.rstrip().partition(' ')
-                if not path or path[0]=='#':
-                    continue
-                try:
-                    pri=int(priority)
-                except:
-                    pri=1
-                self.append((path,pri))
+        # Parse of our file, dropped as soon as we're edited in memory:
+        self.parsed:ParsedIndex = parseIndexFile(self.path)
+        self.sig:tuple = self.parsed.sig  # Of the file our entries came from
+        self._delta:Dict[str,int] = {}  # Our edits since: priority, or None if deleted
+        self._fragments:FragmentIndex = None
+        self._trie = None
+        self._masks = None
+        self._keys:List[str] = None
+        self._priority:Dict[str,int] = None
+        self._visits = False  # Not loaded yet; None if there's no visit log
+        self.compact:tox_cache.CompactEntries = None
+        if isinstance(self.parsed.entries, tuple):
+            self.extend(self.parsed.entries)
+        else:
+            self.compact = self.parsed.entries
+
+    def __len__(self) -> int:
+        return list.__len__(self) if self.compact is None else len(self.compact)
+
+    def __iter__(self) -> Iterator[Tuple[str,int]]:
+        return list.__iter__(self) if self.compact is None else iter(self.compact)
+
+    def __getitem__(self, n):
+        return list.__getitem__(self, n) if self.compact is None else self.compact[n]
+
+    def unpack(self) -> None:
+        """ Copy compact entries into the list, which we're about to edit """
+        if self.compact is not None:
+            entries, self.compact = self.compact, None
+            self.extend(entries)
 
     def Empty(self) -> bool:
         """ Return true if index chain has no entries at all """
@@ -167,121 +367,476 @@ class IndexContent(list):
             pass
         return dir
 
+    def modified(self, reordered:bool=False) -> None:
+        """ Note that our entries no longer match what was parsed from file.
+        'reordered' means they changed other than through addDir/delDir. """
+        self.parsed = None
+        self._fragments = None
+        self._trie = None
+        self._masks = None
+        if reordered:
+            self._keys = None
+            self._priority = None
+
+    def fragmentIndex(self) -> FragmentIndex:
+        """ Fragment index over our current entries """
+        if self.parsed is not None:
+            return self.parsed.fragmentIndex()
+        if self._fragments is None:
+            self._fragments = FragmentIndex.build([e[0] for e in self])
+        return self._fragments
+
+    def pathTrie(self) -> "tox_trie.PathTrie":
+        """ Path trie over our current entries, for lookups below a dir """
+        if self.parsed is not None:
+            return self.parsed.pathTrie(self.indexRoot())
+        if self._trie is None:
+            from tox_trie import PathTrie
+            self._trie = PathTrie.build([self.absPath(e[0]) for e in self])
+        return self._trie
+
+    def fuzzyMasks(self) -> Sequence[int]:
+        """ tox_fuzzy.charMask() of each of our entries """
+        if self.parsed is not None:
+            return self.parsed.fuzzyMasks()
+        if self._masks is None:
+            from tox_fuzzy import pathMasks
+            self._masks = pathMasks(e[0] for e in self)
+        return self._masks
+
+    def visits(self) -> "tox_visits.VisitLog":
+        """ Our visit log, or None if nothing was ever chosen from this index """
+        if self._visits is False:
+            self._visits = tox_visits.loadVisits(self.path)
+        return self._visits
+
+    def editable(self) -> None:
+        """ Get ready for addDir/delDir: sort entries the way write() orders
+        them, alongside a parallel array of their paths for bisecting and a
+        path->priority map for membership tests. """
+        if self._keys is None:
+            self.unpack()
+            self.sort()
+            self._keys = [e[0] for e in self]
+            self._priority = dict(self)
+
     def addDir(self, xdir: str, priority: int) -> bool:
         dir = self.relativePath(xdir)
-        if dir in self:
-            return False  # no change
+        self.editable()
+        old = self._priority.get(dir)
+        if old == priority:
+            raise AddEntryAlreadyPresent()
+        self.modified()
+        self._priority[dir] = priority
+        self._delta[dir] = priority
         entry=(dir,priority)
-        n = bisect.bisect([p[0] for p in self], dir)
-        try:
-            if self[n-1][0]==dir:
-                if self[n-1][1] == priority:
-                    raise AddEntryAlreadyPresent()
-                self[n-1]=entry  # Update existing entry
-                return True
-        except IndexError:
-            ...
-        self.insert(n, entry)
+        if old is None:
+            n = bisect.bisect(self._keys, dir)
+            self._keys.insert(n, dir)
+            self.insert(n, entry)
+        else:
+            self[bisect.bisect(self._keys, dir) - 1]=entry  # Update existing entry
         return True
 
+    def addDirs(self, dirs:Iterable[Tuple[str,int]]) -> Tuple[int,int,int]:
+        """ Bulk addDir(): collect all the (dir,priority) pairs, then merge the
+        new ones in with a single pass.  Returns counts of entries (added,
+        updated, already present) """
+        self.editable()
+        added:Dict[str,int] = {}
+        updated = unchanged = 0
+        for xdir,priority in dirs:
+            dir = self.relativePath(xdir)
+            if not dir:
+                continue  # The index root itself, which can't be an entry
+            old = self._priority.get(dir)
+            if old is None:
+                added[dir] = priority
+            elif old == priority:
+                unchanged += 1
+            else:
+                self._priority[dir] = priority
+                self._delta[dir] = priority
+                self[bisect.bisect(self._keys, dir) - 1] = (dir,priority)
+                updated += 1
+        if added or updated:
+            self.modified()
+        if added:
+            self._priority.update(added)
+            self._delta.update(added)
+            self[:] = heapq.merge(list(self), sorted(added.items()))
+            self._keys = [e[0] for e in self]
+        return (len(added), updated, unchanged)
+
     def delDir(self, xdir: str) -> bool:
         dir = self.relativePath(xdir)
-        for e in self:
-            if e[0]==dir:
-                self.remove(e)
-                return True
-        return False
-
-    def clean(self) -> None:
-        # Remove dead paths from index
-        okEntries = set()
-        for entry in self:
-            path=entry[0]
-            full = self.absPath(path)
-            if not isdir(full):
-                sys.stderr.write("Stale dir removed: %s\n" % full)
-            else:
-                okEntries.add(entry)
+        self.editable()
+        if dir not in self._priority:
+            return False
+        n = bisect.bisect_left(self._keys, dir)
+        del self._keys[n]
+        del self[n]
+        if n < len(self._keys) and self._keys[n] == dir:
+            self._priority[dir] = self[n][1]  # A duplicate line remains
+        else:
+            del self._priority[dir]
+            self._delta[dir] = None
+        self.modified()
+        return True
 
+    def clean(self, workers:int=None, timeout:float=None, dryRun:bool=False) -> None:
+        """ Remove dead paths and duplicate entries from the index.  Dirs are
+        checked concurrently, and any check that takes longer than 'timeout'
+        (say, on a hung automount) counts as unknown: its entry is kept. """
+        from tox_walk import boundedMap
+        okEntries = list(dict.fromkeys(self))  # Drop exact dupes, keep order
+        dead = set()
+        unknown = 0
+        fulls = dict.fromkeys(self.absPath(e[0]) for e in okEntries)
+        for full, exists, error in boundedMap(isdir, fulls, workers, timeout):
+            if error is not None:
+                unknown += 1
+                sys.stderr.write("Unknown (check timed out), kept: %s\n" % full)
+            elif not exists:
+                dead.add(full)
+                sys.stderr.write("Stale dir%s: %s\n" % (" found" if dryRun else " removed", full))
+        okEntries = [e for e in okEntries if self.absPath(e[0]) not in dead]
+        self._delta.update((e[0], None) for e in self if self.absPath(e[0]) in dead)
+        if dryRun:
+            sys.stderr.write("Dry run: %d of %d entries in %s would be removed, %d unknown\n"
+                             % (len(self) - len(okEntries), len(self), self.path, unknown))
+            return
+
+        self.compact = None
         del self[:]
         self.extend(okEntries)
+        self.modified(reordered=True)
         self.write()
         sys.stderr.write("Cleaned index %s, %s dirs remain\n" % (self.path, len(self)))
 
+    def rebase(self) -> None:
+        """ Reload our entries from the file, which someone else rewrote since
+        we read it, and redo our own edits on top """
+        try:
+            merged = dict(parseIndexFile(self.path).entries)
+        except FileNotFoundError:
+            merged = {}
+        for dir, priority in self._delta.items():
+            if priority is None:
+                merged.pop(dir, None)
+            else:
+                merged[dir] = priority
+        self.compact = None
+        self[:] = merged.items()
+        self.modified(reordered=True)
+
+    def journaled(self) -> bool:
+        return self.sig[3] >= 0
+
     def write(self) ->None:
-        # Write the index back to file
-        with open(self.path + ".tmp", "w") as f:
-            for entry in sorted(self):
-                f.write("%s %d\n" % entry)
-        os.rename(self.path + ".tmp", self.path)
-
-    def matchPaths(self, patterns:List[str], fullDirname:bool=False) ->List[str]:
-        """ Returns matches of items in the index. """
-
-        # Identify all the potential matches, filter by all patterns:
-        cand_entries = self[:]
-        for pattern in patterns:
-            qual_entries = []
-            for entry in cand_entries:
-                path=entry[0]
-                for frag in path.split("/"):
-                    if fnmatch.fnmatch(frag, pattern):
-                        # If fullDirname is set, we'll render an absolute path.
-                        # Or... if the relative path is not a dir, we'll also
-                        # render it as absolute.  This allows for cases where an
-                        # outer index path happens to match a local relative path
-                        # which isn't indexed.
-                        if fullDirname or not isdir(path):
-                            qual_entries.append((self.absPath(path),entry[1]))
-                        else:
-                            qual_entries.append((path,entry[1]))
-            cand_entries = qual_entries
-
-        # Remove dupes:
-        xs = IndexedSet()
-        for entry in cand_entries:
-            xs.add(entry)
-        if self.outer is not None:
-            # We're a chain, so recurse:
-            pp = self.outer.matchPaths(patterns, True)
-            xs = xs.union(pp)
-        return sorted(list(xs),key=lambda entry: len(entry[0])/entry[1])
-
-
-class AutoContent(list):
-    """ Reader/parser of the .tox-auto files """
-
-    def __init__(self, path):
-        self.path = path
-        self.tagsLoc = None
-        self.descLoc = None
-        if path:
-            with open(path, "r") as f:
-                self.extend(f.readlines())
-
-        lineNdx = 0
-        for line in self:
-
-            # Locate the .TAGS and .DESC content:
-            if not self.tagsLoc and line.startswith("# .TAGS:"):
-                self.tagsLoc = (lineNdx, 8)
-            elif not self.descLoc and line.startswith("# .DESC:"):
-                self.descLoc = (lineNdx, 8)
-
-            lineNdx += 1
-
-    def tags(self):
-        """ Return the value of .TAGS as array of strings """
-        if not self.tagsLoc:
-            return []
-        raw = self[self.tagsLoc[0]][self.tagsLoc[1] :]
-        return raw.split()
-
-    def desc(self):
-        """ Return the value of .DESC as a string """
-        if self.descLoc is None:
-            return ""
-        return self[self.descLoc[0]][self.descLoc[1] :].rstrip()
+        """ Write the index back to file.  Writers take turns holding an
+        exclusive lock on <index>.lock, and if the file has changed since we
+        read it, our edits are merged into the new version rather than
+        overwriting it.  Readers need no lock: the file is replaced whole.
+        A journaled index only gets our edits appended to its journal,
+        until that's big enough to be worth compacting. """
+        with IndexLock(self.path):
+            try:
+                current = indexSignature(self.path)
+            except FileNotFoundError:
+                current = None
+            if current is not None and current[3] >= 0:
+                self.appendJournal()
+                if current[3] > max(journalCompactBytes, current[1] // 4):
+                    compactJournal(self.path)
+            else:
+                if current != self.sig:
+                    self.rebase()
+                writeSnapshot(self.path, sorted(self))
+            self.sig = indexSignature(self.path)
+            self._delta = {}
+
+    def appendJournal(self) -> None:
+        """ Append our edits to the journal, in one write """
+        records = ["+%s %d\n" % (dir, pri) if pri is not None else "-%s\n" % dir
+                   for dir, pri in self._delta.items()]
+        with open(self.path + journalSuffix, "a") as f:
+            f.write("".join(records))
+
+    def chain(self) -> Iterator[IndexContent]:
+        """ Ourselves, then the indices we're chained to """
+        ix = self
+        while ix is not None:
+            yield ix
+            ix = ix.outer
+
+    def matchPaths(self, patterns:List[str], fullDirname:bool=False, limit:int=None,
+                   under:str=None, fuzzy:bool=False) -> RankedMatches:
+        """ Returns matches of items in the index chain, best first, each
+        dir only once.  With 'limit', at most that many.  With 'under', only
+        dirs below it, matching in the part of their path below it.  With
+        'fuzzy', patterns are tox_fuzzy queries rather than globs. """
+        hits = [ix.matchEntries(patterns, fullDirname or ix is not self, under, fuzzy)
+                for ix in self.chain()]
+        return RankedMatches(hits, self.absPath, limit, fuzzyRankKey if fuzzy else rankKey)
+
+    def matchEntries(self, patterns:List[str], fullDirname:bool=False,
+                     under:str=None, fuzzy:bool=False) -> List[Tuple[str,float]]:
+        """ Unranked matches in this index alone """
+
+        # Identify the entries with a fragment matching each of the patterns.
+        # If fullDirname is set, we'll render absolute paths.  Relative paths
+        # are only meaningful to the user when they're relative to $PWD, i.e.
+        # when we're sitting in the index root; otherwise render them as
+        # absolute too, so they can't be confused with an unindexed dir
+        # that happens to have the same relative name.
+        # Entries we've been choosing lately rank higher: their frecency
+        # (see tox_visits.py) adds to their priority.  Fuzzy matches are
+        # ranked by their score times that.
+        relative = not fullDirname and pwd() == self.indexRoot()
+        visits = self.visits()
+        now = time.time()
+        cand_entries = []
+        if fuzzy:
+            scores = self.fuzzyMatch(patterns, under)
+            ids = sorted(scores)
+        else:
+            ids = self.fragmentIndex().match(patterns)
+            if under is not None and ids:
+                ids = self.matchBelow(ids, patterns, under)
+        for n in ids:
+            path,pri = self[n]
+            full = self.absPath(path)
+            if visits is not None:
+                pri += visits.score(full, now)
+            if fuzzy:
+                pri *= scores[n]
+            if relative:
+                cand_entries.append((path,pri))
+            else:
+                cand_entries.append((full,pri))
+        return cand_entries
+
+    def fuzzyMatch(self, queries:List[str], under:str=None) -> Dict[int,int]:
+        """ Entry id -> total score, of the entries matching all 'queries'.
+        With 'under', of the entries below it, scored on the part of their
+        path below it. """
+        from tox_fuzzy import FuzzyQuery
+        masks = self.fuzzyMasks()
+        if under is None:
+            ids = None
+            path = lambda n: self[n][0]
+        else:
+            ids = self.pathTrie().below(under)
+            skip = len(under.rstrip("/")) + 1
+            path = lambda n: self.absPath(self[n][0])[skip:]
+        scores = None
+        for query in queries:
+            hits = FuzzyQuery(query).match(path, masks, ids)
+            if scores is None:
+                scores = dict(hits)
+            else:
+                scores = {n: scores[n] + s for n, s in hits if n in scores}
+            if not scores:
+                break
+            ids = sorted(scores)
+        return scores or {}
+
+    def matchBelow(self, ids:List[int], patterns:List[str], under:str) -> List[int]:
+        """ Those of entries 'ids' below dir 'under' with a fragment matching
+        each pattern in the part of their path below it """
+        from fnmatch import fnmatchcase
+        below = self.pathTrie().below(under)
+        if len(below) < len(ids):
+            ids = set(ids)
+            ids = [n for n in below if n in ids]
+        else:
+            below = set(below)
+            ids = [n for n in ids if n in below]
+        skip = len(under.rstrip("/")) + 1
+        def matches(n:int) -> bool:
+            frags = self.absPath(self[n][0])[skip:].split("/")
+            return all(any(fnmatchcase(f, p) for f in frags) for p in patterns)
+        return [n for n in ids if matches(n)]
+
+
+def _unpackFirst(name:str):
+    """ Wrap list method 'name' to unpack a compact IndexContent before it
+    runs, since the list proper is empty until then """
+    method = getattr(list, name)
+    def unpacked(self, *args, **kwargs):
+        self.unpack()
+        return method(self, *args, **kwargs)
+    unpacked.__name__ = name
+    return unpacked
+
+for _name in ('__repr__', '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__',
+              '__contains__', '__reversed__', '__add__', '__mul__', '__rmul__',
+              '__iadd__', '__imul__', '__setitem__', '__delitem__',
+              'append', 'extend', 'insert', 'remove', 'pop', 'clear', 'index',
+              'count', 'copy', 'sort', 'reverse'):
+    setattr(IndexContent, _name, _unpackFirst(_name))
+del _name
+
+
+class IndexLock(object):
+    ''' Exclusive advisory lock on <index>.lock, held by index writers '''
+    def __init__(self, path:str):
+        self.path = path + lockSuffix
+
+    def __enter__(self):
+        import fcntl
+        self.lock = open(self.path, "a")
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        self.lock.close()
+
+
+def writeSnapshot(path:str, entries:Iterable[Tuple[str,int]]) -> None:
+    """ Replace index file 'path' with 'entries', atomically.  The new file's
+    mtime is made later than the old one's: file times only tick every few
+    ms, and the new file may reuse the old inode and size, which would give
+    it the same indexSignature() as a version other processes have cached. """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        for entry in entries:
+            f.write("%s %d\n" % entry)
+    try:
+        old = stat(path)
+    except FileNotFoundError:
+        old = None
+    if old is not None:
+        st = stat(tmp)
+        if st.st_mtime_ns <= old.st_mtime_ns:
+            os.utime(tmp, ns=(st.st_atime_ns, old.st_mtime_ns + 1))
+    os.replace(tmp, path)
+
+
+def compactJournal(path:str) -> None:
+    """ Fold the journal of index 'path' into the index file.  Caller holds
+    the IndexLock.  A reader catching the new index with the old journal
+    still sees the same entries, as replaying is idempotent. """
+    entries = sorted(parseIndexFile(path).entries)
+    writeSnapshot(path, entries)
+    # Replaced rather than truncated, so a reader half way through it
+    # doesn't replay just the start of it:
+    writeSnapshot(path + journalSuffix, ())
+
+
+def setJournaled(path:str, on:bool) -> None:
+    """ Switch index 'path' to the journaled format or back (exporting it
+    as a plain index, with no journal) """
+    with IndexLock(path):
+        if on:
+            if not exists(path + journalSuffix):
+                open(path + journalSuffix, "w").close()
+        elif exists(path + journalSuffix):
+            compactJournal(path)
+            os.unlink(path + journalSuffix)
+
+
+def rankKey(entry:Tuple[str,float]) -> float:
+    """ Shorter paths and higher priorities first """
+    return len(entry[0])/entry[1]
+
+
+def fuzzyRankKey(entry:Tuple[str,float]) -> Tuple[float,int]:
+    """ For fuzzy matches, whose 'priority' is their score times their
+    priority: highest first, then shorter paths """
+    return (-entry[1], len(entry[0]))
+
+
+def rankedStream(entries:List[Tuple[str,float]], key:Callable=rankKey) -> Iterator[Tuple[str,float]]:
+    """ Yield entries in 'key' order, only ranking as many as are taken.
+    heapq.nsmallest(k) is stable like sorted(), and O(len*log(k)); k doubles
+    as we go, and once it nears the length a plain sort is quicker. """
+    ranked = []
+    for n in range(len(entries)):
+        if n == len(ranked):
+            k = max(32, 2 * n)
+            if k * 4 >= len(entries):
+                ranked = sorted(entries, key=key)
+            else:
+                ranked = heapq.nsmallest(k, entries, key=key)
+        yield ranked[n]
+
+
+def heapStream(entries:List[Tuple[str,float]], key:Callable=rankKey) -> Iterator[Tuple[str,float]]:
+    """ Yield entries in 'key' order off a heap, built right away: O(len) up
+    front, then O(log(len)) per entry taken, however many are.  Entries tie
+    in order of appearance, as with sorted(). """
+    heap = [(key(e), n, e) for n, e in enumerate(entries)]
+    heapq.heapify(heap)
+    def pop() -> Iterator[Tuple[str,float]]:
+        while heap:
+            yield heapq.heappop(heap)[2]
+    return pop()
+
+
+class RankedMatches(object):
+    ''' Sequence of the matching (path,priority) entries of an index chain,
+    in rankKey() order (or 'key's).  Each index's hits are ranked lazily (rankedStream) and
+    the streams are merged on demand, dropping any dir seen before: a menu only
+    shows a page, and 'to foo 2' only needs the first three.  Ties keep their
+    order of appearance, inner indices first. '''
+    def __init__(self, hits:List[List[Tuple[str,float]]], absPath:Callable[[str],str]=None,
+                 limit:int=None, key:Callable=rankKey):
+        self._absPath = absPath or (lambda path: path)
+        self._hits = hits
+        self._key = key
+        self._merged = heapq.merge(*[rankedStream(h, key) for h in hits], key=key)
+        self._seen = set()
+        self._ranked:List[Tuple[str,float]] = []
+        if limit is not None:
+            self._rankTo(limit)  # Early stop: the rest is never looked at
+            self._len = len(self._ranked)
+        else:
+            self._len = len({self._absPath(e[0]) for h in hits for e in h})
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _rankTo(self, n:int) -> None:
+        while len(self._ranked) < n:
+            entry = next(self._merged, None)
+            if entry is None:
+                return
+            full = self._absPath(entry[0])
+            if full not in self._seen:
+                self._seen.add(full)
+                self._ranked.append(entry)
+
+    def rankAhead(self) -> None:
+        """ Rank the rest off heaps built now, for a consumer that will read
+        far ahead (tox_live's menu): rankedStream re-ranks its whole index
+        each time it runs out, which a keystroke would have to wait for.
+        What's ranked already is met again, and dropped as seen. """
+        self._merged = heapq.merge(*[heapStream(h, self._key) for h in self._hits], key=self._key)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[n] for n in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("match index out of range")
+        self._rankTo(i + 1)
+        return self._ranked[i]
+
+    def __iter__(self):
+        """ Ranks as it goes, so a consumer that stops early (e.g. the
+        tox_live menu) doesn't pay for ranking the rest """
+        for i in range(len(self)):
+            self._rankTo(i + 1)
+            yield self._ranked[i]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"RankedMatches({list(self)!r})"
 
 
 def isFileInDir(dir:str, name:str) -> bool:
@@ -296,6 +851,12 @@ def isChildDir(parent:str, cand:str) -> bool:
     return False
 
 
+@functools.lru_cache(maxsize=None)
+def userName(uid:int) -> str:
+    """ getpwuid(uid).pw_name, memoized: it may be an NSS/LDAP round trip """
+    return getpwuid(uid).pw_name
+
+
 def ownerCheck(xdir:str, filename:str, only_mine:bool) -> bool:
     """Apply ownership rule to file xdir/filename, such that:
     - If only_mine is True, owner of the file must match os.environ['USER']
@@ -306,12 +867,26 @@ def ownerCheck(xdir:str, filename:str, only_mine:bool) -> bool:
     owner = stat("/".join((xdir, filename))).st_uid
     user = os.environ.get('USER','root')
     try:
-        return getpwuid(owner).pw_name == user
+        return userName(owner) == user
     except KeyError:
         # we can't ident the owner:
         return True
 
 
+# Results of findIndex(), keyed by its inputs.  Each value is (index path,
+# stamps), where stamps holds the mtimes of all dirs that were probed for an
+# index file: creating, removing or replacing an index in any of them changes
+# its dir's mtime, which invalidates the entry.
+discoveryCache:Dict[tuple,Tuple[str,tuple]] = {}
+
+def dirStamps(dirs:List[str]) -> tuple:
+    """ mtimes of 'dirs', or None if any of them can't be stat'ed """
+    try:
+        return tuple(stat(d).st_mtime_ns for d in dirs)
+    except OSError:
+        return None
+
+
 def findIndex(xdir:str=None, only_mine:bool=True) -> IndexContent:
     """Find the index containing current dir or 'xdir' if supplied.  Return HOME/.tox-index as a last resort, or None if there's no indices whatsoever.
 
@@ -319,6 +894,22 @@ def findIndex(xdir:str=None, only_mine:bool=True) -> IndexContent:
     """
     if not xdir:
         xdir = pwd()
+    key = (xdir, only_mine, file_sys_root, environ.get("HOME"), environ.get("USER"))
+    hit = discoveryCache.get(key)
+    if hit is not None:
+        probed, stamps = hit[1]
+        if dirStamps(probed) == stamps:
+            return hit[0]
+    probed = []
+    found = searchIndex(xdir, only_mine, probed)
+    stamps = dirStamps(probed)
+    if stamps is not None:
+        discoveryCache[key] = (found, (probed, stamps))
+    return found
+
+
+def searchIndex(xdir:str, only_mine:bool, probed:List[str]) -> str:
+    """ Uncached findIndex(): the dirs checked for an index are appended to 'probed' """
     global indexFileBase
     if not isChildDir(file_sys_root, xdir):
         xdir = os.path.realpath(xdir)
@@ -328,19 +919,32 @@ def findIndex(xdir:str=None, only_mine:bool=True) -> IndexContent:
             if xdir != file_sys_root:
                 # If we've searched all the way up to the root /, try the
                 # user's HOME dir:
-                return findIndex(environ["HOME"])
-    if isFileInDir(xdir, indexFileBase) and ownerCheck(xdir, indexFileBase, only_mine):
-        return "/".join([xdir, indexFileBase])
-    if isFileInDir(xdir, indexFileBase) and xdir == environ["HOME"]:
-        return "/".join([xdir, indexFileBase])
+                return searchIndex(environ["HOME"], True, probed)
+    probed.append(xdir)
+    if isFileInDir(xdir, indexFileBase):
+        if ownerCheck(xdir, indexFileBase, only_mine) or xdir == environ["HOME"]:
+            return "/".join([xdir, indexFileBase])
     # Recurse to parent dir:
     if xdir == file_sys_root:
         # If we've searched all the way up to the root /, try the user's HOME
         # dir:
-        return findIndex(environ["HOME"])
+        return searchIndex(environ["HOME"], True, probed)
+
+    log(f"findIndex returns: xdir={xdir}, HOME={environ['HOME']}, file_sys_root={file_sys_root}")
+    return searchIndex(dirname(xdir), only_mine, probed)
+
 
-    logging.info(f"findIndex returns: xdir={xdir}, HOME={environ['HOME']}, file_sys_root={file_sys_root}")
-    return findIndex(dirname(xdir))
+def indexChain(xdir:str=None) -> Iterator[str]:
+    """ Yield the path of the index for xdir, then those of the indices
+    further up the tree which loadIndex(xdir, True) chains to it """
+    ix = findIndex(xdir)
+    while ix:
+        yield ix
+        if xdir == environ["HOME"]:
+            return
+        ix = findIndex(dirname(dirname(ix)))  # Bug?
+        # ix = findIndex(dirname(ix))
+        xdir = dirname(ix) if ix else None
 
 
 def loadIndex(xdir:str=None, deep:bool=False, inner=None) -> IndexContent:
@@ -349,19 +953,19 @@ def loadIndex(xdir:str=None, deep:bool=False, inner=None) -> IndexContent:
     if xdir and not isdir(xdir):
         raise RuntimeError("non-dir %s passed to loadIndex()" % xdir)
 
-    ix:IndexContent = findIndex(xdir)
-    if not ix:
-        return None
-
-    ic = IndexContent(ix)
-    if not inner is None:
-        inner.outer = ic
-    if deep and not xdir == environ["HOME"]:
-        ix = findIndex(dirname(ic.indexRoot()))  # Bug?
-        # ix = findIndex(ic.indexRoot())
-        if ix:
-            loadIndex(dirname(ix), True, ic)
-    return inner if not inner is None else ic
+    head = inner
+    for depth, ix in enumerate(indexChain(xdir)):
+        if maxChainDepth is not None and depth >= maxChainDepth:
+            break
+        ic = IndexContent(ix)
+        if inner is not None:
+            inner.outer = ic
+        if head is None:
+            head = ic
+        if not deep:
+            break
+        inner = ic
+    return head
 
 
 class ResolveMode(object):
@@ -370,11 +974,24 @@ class ResolveMode(object):
     calc = 3  # calculate the match list and return it
 
 
-def resolvePatternToDir(patterns:List[str], mode:ResolveMode=ResolveMode.userio) -> Tuple[List,str]:
+def chainCovering(ix:IndexContent, xdir:str) -> IndexContent:
+    """ The part of index chain 'ix' from the index for xdir on, or None if
+    that index isn't in the chain """
+    path = findIndex(xdir)
+    for i in ix.chain():
+        if i.path == path:
+            return i
+    return None
+
+
+def resolvePatternToDir(patterns:List[str], mode:ResolveMode=ResolveMode.userio,
+                        under:str=None, chain:IndexContent=None) -> Tuple[List,str]:
     """ Match patterns to index, choose Nth result or prompt user, return dirname to caller. If printonly, don't prompt, just return the list of matches."""
-    # Multiple patterns are handled with recursion: the first is used to select first level, then an index is loaded there and the second pattern is selected
+    # Multiple patterns are handled with recursion: the first is used to select
+    # first level, then the second pattern is matched only below it ('under'),
+    # in the index chain we already have if it covers that dir
 
-    pattern_0=f'*{patterns[0]}*'
+    pattern_0=patterns[0] if fuzzyMatching else f'*{patterns[0]}*'
     K=None
     N=None
     next_pattern=1
@@ -396,7 +1013,10 @@ def resolvePatternToDir(patterns:List[str], mode:ResolveMode=ResolveMode.userio)
         ...
 
     # ix is the directory index:
-    ix:IndexContent = loadIndex(pwd(), K in ["//", "/"])
+    deep = K in ["//", "/"]
+    ix:IndexContent = chainCovering(chain, under) if chain is not None and not deep else None
+    if ix is None:
+        ix = loadIndex(under or pwd(), deep)
     if K == "/":
         # Skip inner index, which can be achieved by walking the index chain up
         # one level
@@ -423,13 +1043,12 @@ def resolvePatternToDir(patterns:List[str], mode:ResolveMode=ResolveMode.userio)
             if mode == ResolveMode.printonly:
                 return printMatchingEntries([rk], rk)
             return (matches,solution)
-        solution=realpath(solution)
-        os.chdir(solution)
-        os.environ['PWD']=solution
         # If there's more patterns, we shall recurse:
-        return resolvePatternToDir(patterns[next_pattern:],  mode)
+        return resolvePatternToDir(patterns[next_pattern:], mode, ix.absPath(solution), ix)
 
-    mx = ix.matchPaths([pattern_0])
+    # To pick the Nth match, the ones after it needn't be looked at:
+    mx = ix.matchPaths([pattern_0], limit=N + 1 if type(N) is int and N >= 0 else None, under=under,
+                       fuzzy=fuzzyMatching)
     if len(mx) == 0:
         return (None, "!No matches for pattern [%s]" % "+".join(patterns))
     if type(N) is int:
@@ -450,7 +1069,7 @@ def resolvePatternToDir(patterns:List[str], mode:ResolveMode=ResolveMode.userio)
     if mode == ResolveMode.calc:
         return [mx, None]
     try:
-        r0 = promptMatchingEntry(mx, ix)
+        r0 = filterMatchingEntry(mx, ix) if incrementalMenu else promptMatchingEntry(mx, ix)
     except UserUpTrap:
         raise UserUpTrap(dirname(ix.path))
 
@@ -476,11 +1095,26 @@ def purp(txt:str) -> str:
     return f"\033[38;5;13m{txt}\033[;0m"
 
 
-def displayMatchingEntries(dx:OrderedDict,ix_path:str) -> None:
+# Existence of dirs we've shown the user, so each is only stat'ed once per
+# process no matter how many menus it appears in:
+dirExistsCache:Dict[str,bool] = {}
+
+def missingDirs(paths:List[str]) -> set:
+    """ Return the subset of (absolute) paths which aren't existing dirs.  Only
+    meant for the handful of entries actually displayed. """
+    for p in paths:
+        if p not in dirExistsCache:
+            dirExistsCache[p] = isdir(p)
+    return {p for p in paths if not dirExistsCache[p]}
+
+
+def displayMatchingEntries(dx:OrderedDict,ix_path:str,missing:set=frozenset()) -> None:
     menu_items=[]
     for i in dx:
         if i[0] == '%':
             menu_items.append(f"{red(i[1:])}{grey(dx[i][0])}")
+        elif dx[i][0] in missing:
+            sys.stderr.write(f"  {grey(dx[i][0])} {red(i)} {grey('(missing)')}\n")
         else:
             sys.stderr.write(f"  {dx[i][0]} {red(i)}\n")
     sys.stderr.write('   '.join(menu_items))
@@ -519,26 +1153,26 @@ def prompt_editor(vstrbuff:List[str],dx:OrderedDict,c:str) -> str:
     # this is called from prompt() for each char read from kbd.  If we
     # return a buffer, that becomes the new edit contents.  If we
     # throw a trap, that bubbles up to the editor's caller.
-    logging.info(f"prompt_editor({ord(c)}:{c})")
+    log(f"prompt_editor({ord(c)}:{c})")
     if ord(c) == 3: # Ctrl+C
         raise KeyboardInterrupt
     elif ord(c) == 127:  # Backspace
         vstrbuff[0] = vstrbuff[0][:-1]
-        logging.info(f"Erase, now: {vstrbuff[0]}")
+        log(f"Erase, now: {vstrbuff[0]}")
         return vstrbuff[0]
     elif ord(c) == 13: # Enter
         if len(vstrbuff[0]) == 0:
             return vstrbuff[0]
         raise UserSelectionTrap(int(vstrbuff[0]))
     elif ord(c) == 27:  # Esc
-        logging.info('[esc]: reset buffer')
+        log('[esc]: reset buffer')
         vstrbuff[0]=""
         return vstrbuff[0]
     elif vstrbuff[0]=="0":
         if c=='0':
             raise UserSelectionTrap(0)
         else:
-            logging.info('reset buffer')
+            log('reset buffer')
             vstrbuff[0]=""
     vstrbuff[0]=vstrbuff[0]+c
     try:
@@ -554,47 +1188,103 @@ def prompt_editor(vstrbuff:List[str],dx:OrderedDict,c:str) -> str:
         except ValueError:
             ofs=None
         v = dx.get(vstrbuff[0],None) or dx[f"%{vstrbuff[0]}"]
-        logging.info(f"User input \"{vstrbuff[0]}\" selects entry [{v}]")
+        log(f"User input \"{vstrbuff[0]}\" selects entry [{v}]")
         if v[1]:  # Is there something special we should throw?
             raise v[1]
         raise UserSelectionTrap(v[0],ofs)
     except KeyError:
-        logging.info(f"User input [{vstrbuff[0]}] doesn't match anything")
+        log(f"User input [{vstrbuff[0]}] doesn't match anything")
         return vstrbuff[0]
 
-def promptMatchingEntry(mx:List[Tuple[str,int]], ix:IndexContent ) ->Tuple[IndexContent,str]:
-    # Prompt user to select from set of matching entries.  Return
-    # tuple of (mx, selected-entry)
-    def get_selector():
-        c = -1
-        while True:
-            c += 1
-            yield c
+def menuPageSize() -> int:
+    """ Menu rows which fit the terminal along with the prompt """
+    try:
+        return max(5, os.get_terminal_size(sys.stderr.fileno()).lines - 4)
+    except OSError:
+        return 20
 
-    sel = iter(get_selector())
+def promptMatchingEntry(mx:RankedMatches, ix:IndexContent ) ->Tuple[IndexContent,str]:
+    # Prompt user to select from set of matching entries.  Return
+    # tuple of (mx, selected-entry).  Entries are shown a page at a time,
+    # so the rest of mx only gets ranked if the user asks for more.
     ixdir=dirname(ix.path)
-    mx_ord=[ ( abbreviate_path( e[0],ixdir ), e[1], e[0] ) for e in mx ]
-    mx_ord=sorted( mx_ord, key=lambda e: len(e[0])/e[1] )
     sys.stderr.write(f"{yellow(':: Index:')} {green(dirname(ix.path))}\n")
-    dx = OrderedDict( {str(next(sel)):(m[0],None) for m in mx_ord} )
-    dx['%q'] = ('<Quit>',KeyboardInterrupt)
-    dx['%\\'] = ('<Up Tree>',UserUpTrap)
-    dx['%/'] = ('<Down Tree>', UserDownTrap)
-    displayMatchingEntries(dx,dirname(ix.path))
+    dx = OrderedDict()
+    shown = 0
+    pageSize = menuPageSize()
     vstrbuff=["0"]
     try:
-        prompt("Choose", 0,lambda c: prompt_editor(vstrbuff,dx,c))
+        while True:
+            page = mx[shown:shown + pageSize]
+            gone = missingDirs([ix.absPath(e[0]) for e in page])
+            rows = OrderedDict()
+            missing = set()
+            for n, e in enumerate(page, shown):
+                rows[str(n)] = (abbreviate_path(e[0], ixdir), None)
+                if ix.absPath(e[0]) in gone:
+                    missing.add(rows[str(n)][0])
+            shown += len(page)
+            dx.pop('%+', None)
+            if shown < len(mx):
+                rows['%+'] = (f'<More ({len(mx) - shown})>', UserMoreTrap)
+            rows['%q'] = ('<Quit>',KeyboardInterrupt)
+            rows['%\\'] = ('<Up Tree>',UserUpTrap)
+            rows['%/'] = ('<Down Tree>', UserDownTrap)
+            dx.update(rows)
+            displayMatchingEntries(rows,ixdir,missing)
+            try:
+                prompt("Choose", vstrbuff[0],lambda c: prompt_editor(vstrbuff,dx,c))
+            except UserMoreTrap:
+                vstrbuff[0]=""
     except UserSelectionTrap as s:
         selection_ofs=s.args[0]
-        logging.info(f"UserSelectionTrap:{s}")
-        return (mx_ord, mx_ord[selection_ofs][2])
+        log(f"UserSelectionTrap:{s}")
+        return (mx, mx[selection_ofs][0])
     except KeyboardInterrupt:
-        logging.info("User Ctrl+C in promptMatchingEntry")
-        return (mx_ord, "!echo Ctrl+C")
-
+        log("User Ctrl+C in promptMatchingEntry")
+        return (mx, "!echo Ctrl+C")
+
+
+def filterMatchingEntry(mx:RankedMatches, ix:IndexContent) -> Tuple[RankedMatches,str]:
+    """ Like promptMatchingEntry(), but typed characters narrow the menu
+    down to the entries containing them (as a subsequence, when matching
+    fuzzily), and Up/Down and Enter choose.  See tox_live.py. """
+    import tox_live
+    ixdir = dirname(ix.path)
+    sys.stderr.write(f"{yellow(':: Index:')} {green(ixdir)}\n")
+    def matcher(text:str) -> Callable[[tuple],bool]:
+        text = text.lower()
+        if fuzzyMatching:
+            from tox_fuzzy import score
+            return lambda item: score(text, item[0]) is not None
+        return lambda item: text in item[0].lower()
+    def render(item:tuple, selected:bool) -> str:
+        label = f"{red('>')} {item[0]}" if selected else f"  {item[0]}"
+        if missingDirs([ix.absPath(item[1][0])]):
+            label += f" {grey('(missing)')}"
+        return label
+    mx.rankAhead()  # Before the menu opens, so keystrokes don't wait on ranking
+    menu = tox_live.LiveMenu(((abbreviate_path(e[0], ixdir), e) for e in mx),
+                             menuPageSize(), matcher, render)
+    keys = getraw_kbd()
+    try:
+        menu.draw()
+        for c in keys:
+            chosen = menu.key(c)
+            if chosen is not None:
+                log(f"Live menu choice: {chosen[1]}")
+                return (mx, chosen[1][0])
+        return (mx, "!echo Ctrl+C")  # Out of input
+    except KeyboardInterrupt:
+        log("User Ctrl+C in filterMatchingEntry")
+        return (mx, "!echo Ctrl+C")
+    finally:
+        if hasattr(keys, "close"):
+            keys.close()  # Back out of raw mode
+        sys.stderr.write("\n")
 
 
-def addDirsToIndex(xargs:List[str], recurse:bool):
+def addDirsToIndex(xargs:List[str], recurse:bool, walker:"TreeWalker"=None):
     # xargs is like '1 dir 1 dir2' , etc.
     priority=1
     try:
@@ -604,6 +1294,7 @@ def addDirsToIndex(xargs:List[str], recurse:bool):
         if not xargs:
             xargs=[pwd(),priority]
 
+    targets:List[Tuple[str,int]] = []
     iargs=iter(xargs)
     for arg in iargs:
         try:
@@ -613,24 +1304,36 @@ def addDirsToIndex(xargs:List[str], recurse:bool):
             xdir=pwd()
         except:
             xdir=arg
-        ix = loadIndex()  # Always load active index for this, even if
-                          # the dir we're adding is out of tree
-
-        def xAdd(path:str,priority:int):
-            try:
-                if ix.addDir(path,priority):
-                    ix.write()
-                    sys.stderr.write("%s added/updated to %s:%d\n" % (path, ix.path,priority))
-                    return
-            except AddEntryAlreadyPresent:
-                sys.stderr.write("%s is already in the index\n" % path)
-
-        xAdd(xdir,priority)
-        if recurse:
-            for r, dirs, _ in os.walk(xdir):
-                dirs[:] = [d for d in dirs if not d[0] == "."]  # ignore hidden dirs
-                for d in dirs:
-                    xAdd(r + "/" + d,priority)
+        targets.append((xdir,priority))
+
+    ix = loadIndex()  # Always load active index for this, even if
+                      # the dir we're adding is out of tree
+    changed = False
+    if not recurse:
+        for xdir,priority in targets:
+            added,updated,_ = ix.addDirs([(xdir,priority)])
+            if added or updated:
+                changed = True
+                sys.stderr.write("%s added/updated to %s:%d\n" % (xdir, ix.path,priority))
+            else:
+                sys.stderr.write("%s is already in the index\n" % xdir)
+    else:
+        if walker is None:
+            from tox_walk import TreeWalker
+            walker = TreeWalker()
+        def walk():
+            for xdir,priority in targets:
+                yield (xdir,priority)
+                for d in walker.walk(xdir):
+                    yield (d,priority)
+
+        added,updated,unchanged = ix.addDirs(walk())
+        changed = added or updated
+        sys.stderr.write("%d added, %d updated, %d already present in %s\n" % (added, updated, unchanged, ix.path))
+        for d in walker.timedOut:
+            sys.stderr.write("Timed out listing %s, its subtree was skipped\n" % d)
+    if changed:
+        ix.write()
 
 
 def delCwdFromIndex():
@@ -646,14 +1349,27 @@ def delCwdFromIndex():
 
 def editIndex():
     ipath = findIndex()
+    if exists(ipath + journalSuffix):
+        # Let the editor see (and own) every entry:
+        with IndexLock(ipath):
+            compactJournal(ipath)
     print("!!$EDITOR %s" % ipath)
 
 
+def journalIndex(mode:str) -> int:
+    ipath = findIndex()
+    setJournaled(ipath, mode == "on")
+    sys.stderr.write("%s is now %s\n" % (ipath, "journaled" if mode == "on" else "a plain index"))
+    return 0
+
+
 def printIndexInfo(ixpath):
     ix = loadIndex(dirname(ixpath) if ixpath else ixpath, True)
     print("!PWD: %s" % (pwd() if not ixpath else dirname(ixpath)))
     print("Index: %s" % ix.path)
     print("# of dirs in index: %d" % len(ix))
+    if ix.journaled():
+        print("Journaled, %d bytes of journal" % ix.sig[3])
     if environ["PWD"] == ix.indexRoot():
         print("PWD == index root")
 
@@ -662,6 +1378,73 @@ def printIndexInfo(ixpath):
         printIndexInfo(ix.outer.path)
 
 
+def completeFragments(prefix:str, limit:int=None) -> List[str]:
+    """ Path fragments starting with 'prefix' in the active index chain, i.e.
+    the words `to` will accept as patterns, for shell completion """
+    limit = completeLimit if limit is None else limit
+    words = set()
+    for ix in indexChain():
+        frags = parseIndexFile(ix).fragmentIndex().frags
+        words.update(f for f in frags if f and f.startswith(prefix))
+    return sorted(words)[:limit]
+
+
+def printCompletions(prefix:str) -> int:
+    for word in completeFragments(prefix):
+        print(word)
+    return 0
+
+
+def needsSidecar(ixpath:str) -> bool:
+    """ Would loading ixpath build its sidecar: is it big enough for one
+    (judging by its lines, and its journal's), and that missing or stale? """
+    try:
+        if tox_cache.loadCache(ixpath, indexSignature(ixpath)) is not None:
+            return False
+        lines = 0
+        for path in (ixpath, ixpath + journalSuffix):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    lines += f.read().count(b"\n")
+    except OSError:
+        return False
+    return lines >= tox_cache.cacheThreshold
+
+
+def prewarm(xdir:str) -> int:
+    """ Load the index chain governing xdir ahead of the first lookup there,
+    if that would (re)build the sidecar of a big index: otherwise the lookup
+    loads it quickly enough.  (A --serve daemon answers this itself, keeping
+    the chain parsed in memory.)  If another prewarm of the same index is
+    running, we leave it to that one. """
+    import fcntl
+    import tox_daemon
+    from zlib import crc32
+    xdir = os.path.join(pwd(), xdir)
+    if not isdir(xdir):
+        return 1
+    ixpath = findIndex(xdir)
+    if not ixpath or not any(needsSidecar(p) for p in indexChain(xdir)):
+        return 0
+    try:
+        # In our private runtime dir, and never through a symlink planted there:
+        lock = os.open(tox_daemon.runtimePath(f"-prewarm-{crc32(ixpath.encode()):08x}.lock"),
+                       os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    except OSError:
+        lock = None  # Warm anyway, unguarded
+    try:
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for ix in loadIndex(xdir, True).chain():
+            ix.fragmentIndex()
+    except BlockingIOError:
+        log(f"prewarm({xdir}): already in progress")
+    finally:
+        if lock is not None:
+            os.close(lock)
+    return 0
+
+
 def ensureHomeIndex():
     global indexFileBase
     loc = "/".join((environ["HOME"], indexFileBase))
@@ -680,9 +1463,9 @@ def createIndexHere():
         sys.stderr.write("Index has been created in %s" % pwd())
 
 
-def cleanIndex():
+def cleanIndex(workers:int=None, timeout:float=None, dryRun:bool=False):
     ix = loadIndex()
-    ix.clean()
+    ix.clean(workers, timeout, dryRun)
 
 
 def hasToxAuto(dir:str) -> bool:
@@ -691,6 +1474,7 @@ def hasToxAuto(dir:str) -> bool:
 
 
 def editToxAutoHere(templateFile:str) -> None:
+    import shutil
     has, _ = hasToxAuto(".")
     if not has:
         # Create from template file first time:
@@ -699,46 +1483,65 @@ def editToxAutoHere(templateFile:str) -> None:
     print("!!$EDITOR %s" % ".tox-auto")
 
 
-def printGrep(pattern, ostream=None):
+def printGrep(pattern:str, tags:List[str]=None, workers:int=None, timeout:float=None,
+              ordered:bool=True) -> bool:
+    """ Print the dirs of the active index, each with the .TAGS and .DESC of
+    its .tox-auto, if their line matches regular expression 'pattern' and
+    they have all of 'tags'.  The .tox-auto files are checked in parallel;
+    lines come in index order, or as they're checked if not 'ordered'.
+    Returns True if anything matched. """
+    import re
+    from tox_auto import loadAutoCache, renderMeta
+    from tox_walk import TimedOut
+    search = None
     if pattern:
-        ostream = StringIO()
-    else:
-        ostream = sys.stdout
+        try:
+            search = re.compile(pattern).search
+        except re.error as e:
+            sys.stderr.write("Bad --grep pattern %r: %s\n" % (pattern, e))
+            return False
     ix = loadIndex()
+    cache = loadAutoCache(ix.path)
+    dirs = list(dict.fromkeys(ix.absPath(e[0]) for e in ix))
+    wanted = set(tags or ())
     sys.stdout.write("!")
-    for entry in ix:
-        dir=entry[0]
-        dir = ix.absPath(dir)
-        ostream.write(dir)
-        has, autoPath = hasToxAuto(dir)
-        if has:
-            cnt = AutoContent(autoPath)
-            ostream.write(" [.TAGS: %s] " % (",".join(cnt.tags())))
-            ostream.write(cnt.desc())
-        ostream.write("\n")
-
     matchCnt = 0
-    if not pattern:
-        return len(ix) > 0
-    else:
-        # Match the pattern and print matches
-        lines = ostream.getvalue().split("\n")
-        for line in lines:
-            try:
-                vv = re.search(pattern, line)
-                if vv:
-                    matchCnt += 1
-                    print(line)
-            except:
-                pass
-
-        return matchCnt > 0
+    for dir, meta, error in cache.harvest(dirs, workers, timeout, ordered):
+        if error is not None:
+            sys.stderr.write("Unknown (.tox-auto check %s), cached info used: %s\n"
+                             % ("timed out" if isinstance(error, TimedOut) else "failed", dir))
+        if wanted and not wanted.issubset(meta[1]):
+            continue
+        line = renderMeta(dir, meta)
+        if search is None or search(line):
+            matchCnt += 1
+            print(line)
+    cache.save(dirs)
+    return matchCnt > 0
 
 
-if __name__ == "__main__":
-    if int(os.environ.get('break_on_main',0)) > 0:
-        breakpoint()
+def main(argv:List[str]=None) -> int:
+    """ Command-line entry point, returns the process exit status """
+    global maxChainDepth, fuzzyMatching, incrementalMenu
     sys.setrecursionlimit(98)
+    if argv is None:
+        argv = sys.argv[1:]
+    # Before the fast paths, which skip argparse (and -z, -i) but not these:
+    fuzzyMatching = int(environ.get("tox_fuzzy") or 0) > 0
+    incrementalMenu = int(environ.get("tox_incremental") or 0) > 0
+    if argv and not [a for a in argv if a.startswith('-')]:
+        # A plain lookup like 'to bin 2' has nothing for argparse to do:
+        ensureHomeIndex()
+        return runLookup(argv, ResolveMode.userio)
+    if argv[:1] == ['--complete'] and len(argv) <= 2:
+        # Runs on every Tab, so skip argparse here as well:
+        ensureHomeIndex()
+        return printCompletions(argv[1] if len(argv) == 2 else "")
+    if argv[:1] == ['--prewarm'] and len(argv) <= 2:
+        ensureHomeIndex()
+        return prewarm(argv[1] if len(argv) == 2 else ".")
+
+    import argparse
     p = argparse.ArgumentParser(
         """to-foo - quick directory-changer v0.9.1 """
     )
@@ -764,6 +1567,39 @@ if __name__ == "__main__":
         dest="add_to_index",
         help="Add to index: <priority> <path> (-r to recurse all)",
     )
+    p.add_argument(
+        "--max-depth",
+        type=int,
+        dest="max_depth",
+        help="With -a -r: don't descend more than N levels",
+    )
+    p.add_argument(
+        "--exclude",
+        action="append",
+        dest="excludes",
+        metavar="GLOB",
+        help="With -a -r: also skip dirs named like GLOB, may be repeated (hidden dirs are always skipped)",
+    )
+    p.add_argument(
+        "--one-file-system",
+        action="store_true",
+        dest="one_file_system",
+        help="With -a -r: don't cross filesystem boundaries",
+    )
+    p.add_argument(
+        "--walk-timeout",
+        type=float,
+        dest="walk_timeout",
+        metavar="SECS",
+        help="With -a -r: give up on dirs that take longer than SECS to list",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        dest="jobs",
+        help="Number of parallel filesystem workers for -a -r, -c, -g and --report",
+    )
     p.add_argument(
         "-d",
         "--del-dir",
@@ -774,6 +1610,19 @@ if __name__ == "__main__":
     p.add_argument(
         "-c", "--cleanup", action="store_true", dest="cleanindex", help="Cleanup index"
     )
+    p.add_argument(
+        "--dry-run",
+        action="store_true",
+        dest="dry_run",
+        help="With -c: report stale dirs, but don't remove them",
+    )
+    p.add_argument(
+        "--path-timeout",
+        type=float,
+        dest="path_timeout",
+        metavar="SECS",
+        help="With -c: treat a dir whose check takes longer than SECS as unknown, and keep it.  With -g or --report: use its cached .tox-auto info",
+    )
     p.add_argument(
         "-q",
         "--query",
@@ -798,6 +1647,20 @@ if __name__ == "__main__":
     #     dest="autoedit",
     #     help="Edit the local .tox-auto, create first if missing",
     # )
+    p.add_argument(
+        "-z",
+        "--fuzzy",
+        action="store_true",
+        dest="fuzzy",
+        help="Match patterns fuzzily, as subsequences of the dir paths (default if $tox_fuzzy=1)",
+    )
+    p.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="Choose among several matches by typing, which narrows the menu as you go (default if $tox_incremental=1)",
+    )
     p.add_argument(
         "-g",
         "--grep",
@@ -805,6 +1668,69 @@ if __name__ == "__main__":
         dest="do_grep",
         help="Match dirnames and .tox-auto search properties against a regular expression",
     )
+    p.add_argument(
+        "--chain-depth",
+        type=int,
+        dest="chain_depth",
+        metavar="N",
+        help="With / or //: search at most N indices up the tree",
+    )
+    p.add_argument(
+        "--prewarm",
+        dest="prewarm",
+        metavar="DIR",
+        help="Load the index chain for DIR ahead of use (run in the background by tox_cd_enter)",
+    )
+    p.add_argument(
+        "--journal",
+        choices=["on", "off"],
+        dest="journal",
+        help="Switch the active index to the journaled format (appends edits to <index>.journal), or back to plain",
+    )
+    p.add_argument(
+        "--tag",
+        action="append",
+        dest="tags",
+        metavar="TAG",
+        help="With -g or --report: only dirs whose .tox-auto has TAG in .TAGS, may be repeated",
+    )
+    p.add_argument(
+        "--report",
+        dest="report",
+        metavar="COLUMNS",
+        help="Print a table of the index's dirs, with COLUMNS from: p (priority), t (tags), d (description), e (exists), v (last visit)",
+    )
+    p.add_argument(
+        "--sort",
+        choices=["dir", "priority", "tags", "desc", "visit"],
+        dest="sort",
+        help="With --report: sort rows by this instead of index order",
+    )
+    p.add_argument(
+        "--format",
+        choices=["plain", "tsv", "json"],
+        default="plain",
+        dest="format",
+        help="With --report: output format",
+    )
+    p.add_argument(
+        "--stream",
+        action="store_true",
+        dest="stream",
+        help="With -g: print matches as soon as they're found, rather than in index order",
+    )
+    p.add_argument(
+        "--serve",
+        action="store_true",
+        dest="serve",
+        help="Run as a resident server, keeping parsed indices warm for later calls",
+    )
+    p.add_argument(
+        "--complete",
+        dest="complete",
+        metavar="PREFIX",
+        help="Print index path fragments starting with PREFIX, for shell completion",
+    )
     # p.add_argument("patterns", nargs='?', help="Pattern(s) to match. If final arg is integer, it is treated as list index. ")
     # p.add_argument(
     # "N", nargs='?', help="Select N'th matching directory, or use '/' or '//' to expand search scope.")
@@ -812,31 +1738,55 @@ if __name__ == "__main__":
 
     try:
         sys.stdout = sys.stderr
-        args, vargs = p.parse_known_args()
+        args, vargs = p.parse_known_args(argv)
     finally:
         sys.stdout = origStdout
 
 
+    if args.serve:
+        import tox_daemon
+        return tox_daemon.serve(sys.modules[__name__])
+
+    if args.complete is not None:
+        return printCompletions(args.complete)
+
+    if args.prewarm is not None:
+        return prewarm(args.prewarm)
+
+    if args.chain_depth is not None:
+        maxChainDepth = args.chain_depth
+    fuzzyMatching = args.fuzzy or fuzzyMatching
+    incrementalMenu = args.incremental or incrementalMenu
     patterns = vargs
     empty = True  # Have we done anything meaningful?
 
     ensureHomeIndex()
 
     if args.do_grep:
-        vv = printGrep(patterns[0] if len(patterns) else None)
-        sys.exit(0 if vv else 1)
+        vv = printGrep(patterns[0] if len(patterns) else None, args.tags,
+                       args.jobs, args.path_timeout, not args.stream)
+        return 0 if vv else 1
+
+    if args.report is not None:
+        from tox_report import printReport
+        vv = printReport(loadIndex(), args.report, args.sort, args.tags, args.format,
+                         args.jobs, args.path_timeout)
+        return 0 if vv else 1
 
     # if args.autoedit:
     #     editToxAutoHere("/".join([tox_core_root, "tox-auto-default-template"]))
-    #     sys.exit(0)
+    #     return 0
 
     if args.create_ix_here:
         createIndexHere()
         empty = False
 
     if args.add_to_index:
-        addDirsToIndex(patterns, args.recurse)
-        sys.exit(0)
+        from tox_walk import TreeWalker
+        walker = TreeWalker(args.max_depth, args.excludes, args.one_file_system,
+                            args.walk_timeout, args.jobs)
+        addDirsToIndex(patterns, args.recurse, walker)
+        return 0
 
     elif args.del_from_index:
         delCwdFromIndex()
@@ -846,22 +1796,30 @@ if __name__ == "__main__":
         printIndexInfo(findIndex())
         empty = False
 
+    if args.journal:
+        return journalIndex(args.journal)
+
     if args.editindex:
         editIndex()
-        sys.exit(0)
+        return 0
 
     if args.cleanindex:
-        cleanIndex()
+        cleanIndex(args.jobs, args.path_timeout, args.dry_run)
         empty = False
 
     if not patterns:
         if not empty:
-            sys.exit(0)
+            return 0
 
         sys.stderr.write("No search patterns specified, try --help\n")
-        sys.exit(1)
+        return 1
+
+    return runLookup(patterns, ResolveMode.printonly if args.printonly else ResolveMode.userio)
+
 
-    rmode = ResolveMode.printonly if args.printonly else ResolveMode.userio
+def runLookup(patterns:List[str], rmode:ResolveMode) -> int:
+    """ Resolve patterns, letting the user move up and down the index tree,
+    and print the outcome for tox_w """
     res = (None,None)
     dirstack=[pwd()]
     while True:
@@ -887,6 +1845,26 @@ if __name__ == "__main__":
 
 
     if res[1]:
+        if rmode == ResolveMode.userio and res[1][0] != '!':
+            recordVisit(res[1])
         print(res[1])
 
-    sys.exit(0)
+    return 0
+
+
+def recordVisit(xdir:str) -> None:
+    """ Log a visit to xdir in the first index of our chain that lists it """
+    xdir = os.path.join(pwd(), xdir)  # Relative ones are relative to pwd
+    for ixpath in indexChain(pwd()):
+        # The parse is shared and its path set built once: no IndexContent copy
+        parsed = parseIndexFile(ixpath)
+        root = dirname(ixpath) + "/"
+        if parsed.hasPath(xdir) or xdir.startswith(root) and parsed.hasPath(xdir[len(root):]):
+            tox_visits.recordVisit(ixpath, xdir)
+            return
+
+
+if __name__ == "__main__":
+    if int(os.environ.get('break_on_main',0)) > 0:
+        breakpoint()
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# tox_daemon.py
+''' Resident server mode for tox_core.py.
+
+    `tox_core.py --serve` listens on a per-user Unix socket and keeps parsed
+    indices warm.  Each `to` invocation then only needs this (small) module:
+    forward() hands argv, the environment, cwd and our stdin/stdout/stderr fds
+    to the server, which forks a worker to run tox_core.main() against them.
+    The worker prints the usual '!'/'!!'/dir protocol straight to our stdout,
+    so tox_w can't tell the difference.
+
+    Both ends make sure the other is running as the same user (SO_PEERCRED)
+    before trusting it: a socket someone else listens on would get our
+    environment and fds, and could make tox_w run anything.
+
+    Set tox_nodaemon=1 to bypass a running server. '''
+import os
+import sys
+import stat
+import struct
+import array
+# socket, json and signal are imported on first use, so that checking for a
+# server costs next to nothing when there isn't one.
+
+FD_COUNT = 3  # stdin, stdout, stderr
+HEADER = struct.Struct("!I")
+STATUS = struct.Struct("!i")
+
+
+def privateDir(path:str) -> bool:
+    """ Is path a real dir of ours, which nobody else can write to? """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def runtimePath(name:str) -> str:
+    """ Per-user location for our sockets and lock files: $XDG_RUNTIME_DIR,
+    else a dir of our own in /tmp.  Raises PermissionError if that dir is
+    someone else's (or a symlink), or others can write to it. """
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if not base:
+        base = f"/tmp/tox-{os.getuid()}"
+        try:
+            os.mkdir(base, 0o700)
+        except FileExistsError:
+            pass
+    if not privateDir(base):
+        raise PermissionError(f"{base} isn't a private dir of ours")
+    return f"{base}/tox-{os.getuid()}{name}"
+
+
+def socketPath() -> str:
+    """ Per-user socket location, override with $tox_socket """
+    return os.environ.get('tox_socket') or runtimePath(".sock")
+
+
+def peerUid(conn:"socket.socket") -> int:
+    """ Uid of the process at the other end of Unix socket conn, or None
+    where the platform can't tell """
+    import socket
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def trustedPeer(conn:"socket.socket", path:str) -> bool:
+    """ Is the other end of conn, connected at 'path', one of our processes?
+    Without SO_PEERCRED, settle for path being our socket in a private dir. """
+    uid = peerUid(conn)
+    if uid is not None:
+        return uid == os.getuid()
+    try:
+        return os.lstat(path).st_uid == os.getuid() and privateDir(os.path.dirname(path) or ".")
+    except OSError:
+        return False
+
+
+def recvExact(conn:"socket.socket", n:int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            raise EOFError("tox daemon connection closed")
+        buf += chunk
+    return buf
+
+
+def forward(argv) -> int:
+    """ Run a tox command through the resident server.  Returns its exit status,
+    or None if there's no usable server (caller should run in-process). """
+    if int(os.environ.get('tox_nodaemon', 0)) > 0 or int(os.environ.get('tox_debugpy', 0)) > 0:
+        return None
+    try:
+        path = socketPath()
+    except OSError:
+        return None  # No safe place for a socket
+    if not os.path.exists(path):
+        return None
+    import json
+    import socket
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+        if not trustedPeer(conn, path):
+            sys.stderr.write(f"Ignoring tox server at {path}: it isn't running as us\n")
+            conn.close()
+            return None
+    except OSError:
+        conn.close()
+        return None  # No server, or a stale socket file
+    try:
+        request = json.dumps({
+            "argv": list(argv),
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+        }).encode()
+        fds = array.array("i", range(FD_COUNT))
+        conn.sendmsg([HEADER.pack(len(request)) + request],
+                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        try:
+            return STATUS.unpack(recvExact(conn, STATUS.size))[0]
+        except EOFError:
+            return 1  # Worker died without reporting
+    finally:
+        conn.close()
+
+
+def receiveRequest(conn:"socket.socket"):
+    """ Read one forwarded request: returns (request dict, [fds]) """
+    import json
+    import socket
+    fds = array.array("i")
+    msg, ancdata, _, _ = conn.recvmsg(HEADER.size, socket.CMSG_LEN(FD_COUNT * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    if len(msg) < HEADER.size:
+        msg += recvExact(conn, HEADER.size - len(msg))
+    size = HEADER.unpack(msg)[0]
+    return json.loads(recvExact(conn, size).decode()), list(fds)
+
+
+def runWorker(core, conn:"socket.socket", request:dict, fds) -> None:
+    """ Forked child: adopt the client's fds, cwd and environment, run the
+    command, report the exit status and never return. """
+    import signal
+    status = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for n, fd in enumerate(fds[:FD_COUNT]):
+            os.dup2(fd, n)
+        for fd in fds:
+            if fd >= FD_COUNT:
+                os.close(fd)
+        os.environ.clear()
+        os.environ.update(request["env"])
+        os.chdir(request["cwd"])
+        core.home_path = os.environ.get('HOME', None)
+        core.set_file_sys_root(os.getenv(core.toxRootKey, "/"))
+        try:
+            status = core.main(request["argv"])
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException as e:
+        sys.stderr.write(f"tox daemon worker failed: {e}\n")
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(STATUS.pack(status or 0))
+        finally:
+            os._exit(0)
+
+
+def warmChain(core, xdir:str) -> None:
+    """ Load the index chain governing xdir into the server's parse cache, so
+    later workers inherit it already parsed, fragment indices and .tox-auto
+    caches included (and fuzzy match masks, if fuzzy matching is the default) """
+    import tox_auto
+    try:
+        ix = core.loadIndex(xdir, True)
+        for i in (ix.chain() if ix is not None else ()):
+            i.fragmentIndex()
+            if int(os.environ.get('tox_fuzzy') or 0) > 0:
+                i.fuzzyMasks()
+            tox_auto.loadAutoCache(i.path)
+    except Exception as e:
+        core.log(f"tox daemon: warmChain({xdir}) failed: {e}")
+
+
+def serve(core) -> int:
+    """ Accept forwarded requests until killed.  'core' is the tox_core module. """
+    import signal
+    import socket
+    try:
+        path = socketPath()
+    except PermissionError as e:
+        sys.stderr.write(f"tox server: {e}\n")
+        return 1
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        sys.stderr.write(f"A tox server is already listening on {path}\n")
+        return 1
+    except OSError:
+        pass
+    finally:
+        probe.close()
+    if os.path.exists(path):
+        os.unlink(path)  # Left over from a dead server
+
+    # Leave the session of the terminal we were started from: as a background
+    # process group in it, a worker setting up an interactive menu on that
+    # terminal would be stopped by SIGTTOU, and us with it.
+    if os.getsid(0) != os.getpid():
+        try:
+            os.setsid()
+        except OSError:
+            # We lead a process group (e.g. `tox_core.py --serve &`), which
+            # only a child of ours can take out of the session
+            pid = os.fork()
+            if pid != 0:
+                sys.stderr.write(f"tox server detached as pid {pid}\n")
+                return 0
+            os.setsid()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(16)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Workers reap themselves
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    sys.stderr.write(f"tox server listening on {path}\n")
+
+    warmChain(core, os.environ.get('HOME', '/'))
+    try:
+        while True:
+            conn, _ = listener.accept()
+            fds = []
+            warm = None  # Dir whose index chain to warm for the next caller
+            try:
+                if peerUid(conn) not in (None, os.getuid()):
+                    core.log(f"tox daemon: refused a connection from uid {peerUid(conn)}")
+                    continue
+                request, fds = receiveRequest(conn)
+                if request["argv"][:1] == ["--prewarm"]:
+                    # No worker needed: warming our own cache is the point.
+                    conn.sendall(STATUS.pack(0))
+                    target = request["argv"][1] if len(request["argv"]) > 1 else "."
+                    warm = os.path.join(request["cwd"], target)
+                else:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    if os.fork() == 0:
+                        listener.close()
+                        runWorker(core, conn, request, fds)
+                    # Parent: while the worker answers, make sure the chain
+                    # it needed is warm for the next caller.
+                    warm = request["env"].get("PWD", request["cwd"])
+            except Exception as e:
+                core.log(f"tox daemon: bad request: {e}")
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+            # Only once the client's fds are closed: tox_w reads its stdout
+            # with $(...), which waits for every copy of it to be closed.
+            if warm is not None:
+                warmChain(core, warm)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        listener.close()
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,140 @@
+# tox_fragindex.py
+''' Inverted index from path fragments to index entries.
+
+    matchPaths() used to fnmatch every fragment of every entry against each
+    pattern.  Here each distinct fragment is tested at most once, and a
+    trigram table narrows substring/glob patterns down to the fragments that
+    contain all of the pattern's literal trigrams before any regex runs.
+
+    The same arrays are written into the binary sidecar (see tox_cache.py),
+    so large indices don't even pay the build cost per process. '''
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable, Dict, List, Sequence
+
+
+def literalRuns(pattern:str) -> List[str]:
+    """ Return the runs of literal text in glob 'pattern', i.e. the text
+    between '*', '?' and '[...]' sets, following fnmatch's parsing rules """
+    runs = []
+    run = ""
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c in "*?":
+            runs.append(run)
+            run = ""
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                run += c  # Unterminated: fnmatch takes '[' literally
+            else:
+                runs.append(run)
+                run = ""
+                i = j + 1
+        else:
+            run += c
+    runs.append(run)
+    return [r for r in runs if r]
+
+
+def trigrams(s:str):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class FragmentIndex(object):
+    ''' frags[f] is a distinct fragment, its entry ids are
+    postings[postOffsets[f]:postOffsets[f+1]].  triKeys is the sorted list of
+    trigrams seen in any fragment, with frag ids in triPostings likewise. '''
+    def __init__(self, frags:List[str], postOffsets:Sequence[int], postings:Sequence[int],
+                 triKeys:List[str], triOffsets:Sequence[int], triPostings:Sequence[int]):
+        self.frags = frags
+        self.postOffsets = postOffsets
+        self.postings = postings
+        self.triKeys = triKeys
+        self.triOffsets = triOffsets
+        self.triPostings = triPostings
+
+    @classmethod
+    def build(cls, paths:Sequence[str]) -> "FragmentIndex":
+        fragPosts:Dict[str,List[int]] = {}
+        for n, path in enumerate(paths):
+            for frag in path.split("/"):
+                posts = fragPosts.get(frag)
+                if posts is None:
+                    fragPosts[frag] = [n]
+                elif posts[-1] != n:  # Fragment repeats within a path
+                    posts.append(n)
+        frags = list(fragPosts)
+        postOffsets = array("I", [0])
+        postings = array("I")
+        triPosts:Dict[str,List[int]] = {}
+        for fid, frag in enumerate(frags):
+            postings.extend(fragPosts[frag])
+            postOffsets.append(len(postings))
+            for t in trigrams(frag):
+                posts = triPosts.get(t)
+                if posts is None:
+                    triPosts[t] = [fid]
+                else:
+                    posts.append(fid)
+        triKeys = sorted(triPosts)
+        triOffsets = array("I", [0])
+        triPostings = array("I")
+        for t in triKeys:
+            triPostings.extend(triPosts[t])
+            triOffsets.append(len(triPostings))
+        return cls(frags, postOffsets, postings, triKeys, triOffsets, triPostings)
+
+    def _trigramFrags(self, t:str) -> Sequence[int]:
+        n = bisect_left(self.triKeys, t)
+        if n == len(self.triKeys) or self.triKeys[n] != t:
+            return ()
+        return self.triPostings[self.triOffsets[n]:self.triOffsets[n + 1]]
+
+    def candidateFrags(self, pattern:str) -> Sequence[int]:
+        """ Ids of fragments which might match 'pattern': those having every
+        trigram of its literal runs, or all of them if it has none """
+        grams = set()
+        for run in literalRuns(pattern):
+            grams |= trigrams(run)
+        if not grams:
+            return range(len(self.frags))
+        cand = None
+        for t in sorted(grams, key=lambda t: len(self._trigramFrags(t))):
+            fids = self._trigramFrags(t)
+            cand = set(fids) if cand is None else cand.intersection(fids)
+            if not cand:
+                break
+        return sorted(cand)
+
+    def matchPattern(self, pattern:str) -> set:
+        """ Ids of entries having at least one fragment matching 'pattern' """
+        import re  # Not at the top: completion gets by without it
+        import fnmatch
+        rx:Callable = re.compile(fnmatch.translate(pattern)).match
+        frags, offsets, postings = self.frags, self.postOffsets, self.postings
+        ids = set()
+        for fid in self.candidateFrags(pattern):
+            if rx(frags[fid]):
+                ids.update(postings[offsets[fid]:offsets[fid + 1]])
+        return ids
+
+    def match(self, patterns:Sequence[str]) -> List[int]:
+        """ Ids of entries matching all patterns, in index order """
+        ids = None
+        for pattern in patterns:
+            ids = self.matchPattern(pattern) if ids is None else ids & self.matchPattern(pattern)
+            if not ids:
+                return []
+        return sorted(ids) if ids else []
@@ -0,0 +1,194 @@
+# tox_fuzzy.py
+''' Fuzzy subsequence matching of index paths, for `to -z` (or tox_fuzzy=1).
+
+    A query matches a path if its characters appear in the path in order,
+    ignoring case, like fzf and zoxide do.  The match is scored on where its
+    characters land: at the start of a fragment or word, right after one
+    another, and in the last fragment of the path all score higher, and gaps
+    between them cost.  RankedMatches then orders by that score times the
+    entry's priority (see fuzzyRankKey in tox_core.py).
+
+    Scoring is too slow to run on every entry of a large index, so each
+    entry has a bitmask of the characters in its path, computed when the
+    index is parsed and kept in its tox_cache sidecar, if it has one.
+    Entries missing any of the query's characters are skipped with a single
+    AND, and only the rest are looked at.  Past scoreLimit matches, only the
+    tightest are scored in full (see FuzzyQuery.match()). '''
+from __future__ import annotations
+import heapq
+from array import array
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Score of each matched character, and bonuses and penalties as in fzf:
+scoreMatch = 16
+scoreGapStart = -3
+scoreGapExtension = -1
+bonusBoundary = 8  # First character of a word: after '_', '-', '.', ' ' etc
+bonusFragment = 10  # First character of a fragment, i.e. after '/'
+bonusCamel = 7  # An upper case letter after a lower case one, or a digit after a letter
+bonusConsecutive = 4  # Follows the previous matched character
+bonusFirstCharMultiplier = 2  # For the bonus of the query's first character
+bonusLastFragment = 2  # Per character matched in the path's last fragment
+scoreLimit = 500  # Most matches of a query scored in full, see FuzzyQuery.match()
+
+# Bit of each character in a mask: letters and digits have their own, any
+# other character shares one of the remaining 28 with others.
+_bits = {c: 1 << n for n, c in enumerate("abcdefghijklmnopqrstuvwxyz0123456789")}
+
+
+def charBit(c:str) -> int:
+    bit = _bits.get(c)
+    return bit if bit is not None else 1 << (36 + ord(c) % 28)
+
+
+def charMask(s:str) -> int:
+    """ Bitmask of the characters in s, ignoring case """
+    mask = 0
+    for bit in set(map(charBit, set(s.lower()))):
+        mask |= bit
+    return mask
+
+
+def pathMasks(paths:Iterable[str]) -> array:
+    """ charMask() of each of 'paths'.  Paths share most of their fragments,
+    so each distinct fragment's mask is only worked out once. """
+    fragMasks:Dict[str,int] = {}
+    def fragMask(frag:str) -> int:
+        mask = fragMasks.get(frag)
+        if mask is None:
+            mask = fragMasks[frag] = charMask(frag)
+        return mask
+    slash = charBit("/")
+    masks = array("Q")
+    for path in paths:
+        mask = slash if "/" in path else 0
+        for frag in path.split("/"):
+            mask |= fragMask(frag)
+        masks.append(mask)
+    return masks
+
+
+def charBonus(prev:str, c:str) -> int:
+    """ Bonus for matching c, the character following prev """
+    if prev == "/":
+        return bonusFragment
+    if not prev.isalnum():
+        return bonusBoundary if c.isalnum() else 0
+    if prev.islower() and c.isupper() or prev.isalpha() and c.isdigit():
+        return bonusCamel
+    return 0
+
+
+class BonusTable(dict):
+    ''' charBonus(), keyed by the two characters as one string: looking
+    that up is quicker than working it out every time '''
+    def __missing__(self, pair:str) -> int:
+        bonus = self[pair] = charBonus(pair[0], pair[1])
+        return bonus
+
+
+bonuses = BonusTable()
+
+
+def matchStart(query:str, lower:str) -> Optional[int]:
+    """ Where the best-placed match of 'query' in 'lower' (both in lower
+    case) starts, or None if it doesn't match.  Like fzf's v1 algorithm:
+    find the first match, then shrink it from its end back to its latest
+    possible start. """
+    end = -1
+    for c in query:
+        end = lower.find(c, end + 1)
+        if end < 0:
+            return None
+    start = end + 1
+    for c in reversed(query):
+        start = lower.rfind(c, 0, start)
+    return start
+
+
+def matchEnd(query:str, lower:str, start:int) -> int:
+    """ Where the match of 'query' starting at 'start' ends """
+    end = start - 1
+    for c in query:
+        end = lower.find(c, end + 1)
+    return end
+
+
+def estimate(query:str, width:int) -> int:
+    """ Score of a match 'width' characters wide, leaving out its bonuses
+    and gap start penalties: a cheap stand-in for score(), which mostly
+    falls below the score of a tighter match """
+    return max(1, scoreMatch * len(query) + scoreGapExtension * (width - len(query)))
+
+
+def score(query:str, path:str, lower:str=None, start:int=None) -> Optional[int]:
+    """ Score of the best-placed match of 'query' (in lower case) in path,
+    or None if it doesn't match.  'start' is its matchStart(), if known. """
+    lower = lower or path.lower()
+    if start is None:
+        start = matchStart(query, lower)
+        if start is None:
+            return None
+    if len(lower) != len(path):
+        path = lower  # Some characters change length with case: score the lower case
+    lastFragment = path.rfind("/") + 1
+    find, bonusOf = lower.find, bonuses.__getitem__
+    total = 0
+    pos = start - 1
+    runBonus = 0  # Bonus of the first character of a run of consecutive matches
+    for n, c in enumerate(query):
+        found = find(c, pos + 1)
+        bonus = bonusOf(path[found - 1:found + 1]) if found else bonusFragment
+        if n and found == pos + 1:
+            if bonus >= bonusBoundary:
+                runBonus = bonus
+            bonus = max(bonus, runBonus, bonusConsecutive)
+        else:
+            if n:
+                total += scoreGapStart + scoreGapExtension * (found - pos - 2)
+            runBonus = bonus
+        total += scoreMatch + (bonus * bonusFirstCharMultiplier if n == 0 else bonus)
+        if found >= lastFragment:
+            total += bonusLastFragment
+        pos = found
+    return total
+
+
+class FuzzyQuery(object):
+    ''' One query, scored against many paths '''
+    def __init__(self, query:str):
+        self.query = query.lower()
+        self.mask = charMask(self.query)
+
+    def match(self, path:Callable[[int],str], masks:Sequence[int],
+              ids:Iterable[int]=None, limit:int=None) -> List[Tuple[int,int]]:
+        """ (id, score) of each entry (or each of 'ids') the query matches,
+        path(n) being the path of entry n and masks[n] its charMask().
+        Past 'limit' matches (default scoreLimit), only that many are scored
+        in full, those whose match is tightest and path shortest; the rest
+        get estimate(). """
+        qmask = self.mask
+        if ids is None:
+            ids = [n for n, m in enumerate(masks) if m & qmask == qmask]
+        else:
+            ids = [n for n in ids if masks[n] & qmask == qmask]
+        query = self.query
+        matched = []  # (id, path, lower case path, match start)
+        for n in ids:
+            p = path(n)
+            lower = p.lower()
+            start = matchStart(query, lower)
+            if start is not None:
+                matched.append((n, p, lower, start))
+        limit = scoreLimit if limit is None else limit
+        if len(matched) <= limit:
+            return [(n, score(query, p, lower, start)) for n, p, lower, start in matched]
+        ends = {}
+        def tightness(m:tuple) -> Tuple[int,int]:
+            end = ends[m[0]] = matchEnd(query, m[2], m[3])
+            return (end - m[3], len(m[1]))
+        best = set(m[0] for m in heapq.nsmallest(limit, matched, key=tightness))
+        return [(n, score(query, p, lower, start) if n in best else
+                 estimate(query, ends[n] + 1 - start)) for n, p, lower, start in matched]
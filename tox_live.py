@@ -0,0 +1,159 @@
+# tox_live.py
+''' The incremental menu of `to -i` (or tox_incremental=1): typed characters
+    narrow the list of matches as they're typed.
+
+    Each character typed adds a Narrowing of the one before, which filters
+    only what that one let through, never the whole index; backspace drops
+    the last one, whose results are kept.  Narrowings are lazy: a keystroke
+    only looks for as many candidates as the viewport shows, and gives up
+    after 'scanBudget' of them, showing a '+' after the count if there may
+    be more.  So a keystroke costs about the same however big the index and
+    however broad the pattern.  Only the rows of the viewport whose text
+    changed are redrawn. '''
+from __future__ import annotations
+import sys
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Iterator, List, Optional, TextIO
+
+scanBudget:int = 5000  # Most candidates looked at per keystroke
+
+
+class Budget(object):
+    ''' Work left for this keystroke, shared by all the narrowings '''
+    def __init__(self):
+        self.left = scanBudget
+
+
+class Narrowing(object):
+    ''' The items of 'parent' (or of iterator 'source', for the first one)
+    passing 'keep', found no further than they're asked for '''
+    def __init__(self, budget:Budget, source:Iterator=None, parent:"Narrowing"=None,
+                 keep:Callable[[tuple],bool]=None):
+        self.budget = budget
+        self.source = source
+        self.parent = parent
+        self.keep = keep
+        self.items:List[tuple] = []
+        self.done = False  # All found
+        self.pos = 0  # Of the next parent item to look at
+
+    def fill(self, n:int) -> bool:
+        """ Find the first n items, if the budget allows.  Returns whether
+        there are that many (False if we're done with fewer, or out of
+        budget). """
+        items, budget = self.items, self.budget
+        while len(items) < n and not self.done:
+            if budget.left <= 0:
+                return False
+            if self.parent is None:
+                item = next(self.source, None)
+                if item is None:
+                    self.done = True
+                    break
+            else:
+                if not self.parent.fill(self.pos + 1):
+                    self.done = self.parent.done
+                    if not self.done:
+                        return False
+                    break
+                item = self.parent.items[self.pos]
+                self.pos += 1
+            budget.left -= 1
+            if self.keep is None or self.keep(item):
+                items.append(item)
+        return len(items) >= n
+
+
+class LiveMenu(object):
+    ''' A viewport of 'rows' rows over the items of 'source' (label, entry)
+    tuples in rank order, above a prompt line showing what's been typed.
+    'matcher(text)' returns the filter of the items matching 'text'.
+    'render(item, selected)' returns the text of an item's row. '''
+    def __init__(self, source:Iterable[tuple], rows:int, matcher:Callable[[str],Callable],
+                 render:Callable[[tuple,bool],str], out:TextIO=None):
+        self.budget = Budget()
+        self.levels = [Narrowing(self.budget, iter(source))]
+        self.rows = rows
+        self.matcher = matcher
+        self.render = render
+        self.out = out or sys.stderr
+        self.query = ""
+        self.top = 0  # Item shown in the first row
+        self.cursor = 0  # Selected item
+        self.escape = ""  # Escape sequence being read
+        self.shown:List[str] = None  # Text of each row as drawn
+
+    def view(self) -> List[str]:
+        """ The rows' text, then the prompt line's """
+        level = self.levels[-1]
+        level.fill(self.top + self.rows + 1)  # One more tells whether to scroll
+        items = level.items[self.top:self.top + self.rows]
+        lines = [self.render(item, self.top + n == self.cursor) for n, item in enumerate(items)]
+        lines += [""] * (self.rows - len(lines))
+        count = "%d%s" % (len(level.items), "" if level.done else "+")
+        lines.append(f"\033[;33mFilter ({count}):\033[;0m {self.query}")
+        return lines
+
+    def draw(self) -> None:
+        """ Draw the viewport, or redraw the rows which changed since """
+        lines = self.view()
+        out = self.out
+        if self.shown is None:
+            out.write("\r\n".join(lines))
+        else:
+            for n, line in enumerate(lines[:-1]):
+                if line != self.shown[n]:
+                    up = self.rows - n
+                    out.write(f"\033[{up}A\r\033[K{line}\033[{up}B")
+            out.write(f"\r\033[K{lines[-1]}")
+        out.flush()
+        self.shown = lines
+
+    def selected(self) -> Optional[tuple]:
+        items = self.levels[-1].items
+        return items[self.cursor] if self.cursor < len(items) else None
+
+    def move(self, delta:int) -> None:
+        level = self.levels[-1]
+        level.fill(self.cursor + delta + 1)
+        self.cursor = max(0, min(self.cursor + delta, len(level.items) - 1))
+        if self.cursor < self.top:
+            self.top = self.cursor
+        elif self.cursor >= self.top + self.rows:
+            self.top = self.cursor - self.rows + 1
+
+    def key(self, c:str) -> Optional[tuple]:
+        """ Handle one keystroke, returning the item chosen with Enter.
+        Ctrl+C raises KeyboardInterrupt. """
+        self.budget.left = scanBudget
+        if self.escape:
+            # Arrow keys are "\033[A" and "\033[B"; other sequences are ignored
+            self.escape += c
+            if len(self.escape) == 2 and c == "[" or len(self.escape) > 2 and not c.isalpha() and c != "~":
+                return None
+            sequence, self.escape = self.escape, ""
+            if sequence in ("\033[A", "\033[B"):
+                self.move(-1 if sequence[-1] == "A" else 1)
+        elif c == "\033":
+            self.escape = c
+            return None
+        elif c == "\003":  # Ctrl+C
+            raise KeyboardInterrupt
+        elif c in "\r\n":
+            if self.selected() is not None:
+                return self.selected()
+        elif c in "\020\016":  # Ctrl+P, Ctrl+N
+            self.move(-1 if c == "\020" else 1)
+        elif c in "\177\010":  # Backspace
+            if len(self.levels) > 1:
+                self.levels.pop()
+                self.query = self.query[:-1]
+                self.top = self.cursor = 0
+        elif c.isprintable():
+            self.query += c
+            self.levels.append(Narrowing(self.budget, parent=self.levels[-1],
+                                         keep=self.matcher(self.query)))
+            self.top = self.cursor = 0
+        self.draw()
+        return None
@@ -0,0 +1,120 @@
+# tox_report.py
+''' `to --report COLUMNS`: a table of the dirs in the active index.
+
+    Each row starts with the dir, followed by the COLUMNS asked for:
+
+        p   priority in the index
+        t   .TAGS of its .tox-auto
+        d   .DESC of its .tox-auto
+        e   whether the dir exists (? if its check timed out)
+        v   when it was last visited with `to`
+
+    The .tox-auto metadata comes from tox_auto.AutoCache, checked in parallel
+    like `to -g` does, and the last visits from the index's visits log, so a
+    report costs about a stat per dir.  A dir whose .tox-auto was found
+    needs no separate existence check. '''
+from __future__ import annotations
+import sys
+import time
+from os.path import isdir
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Dict, List, Sequence
+
+# Column letter: (heading, row key)
+columns:Dict[str,tuple] = {
+    "p": ("PRI", "priority"),
+    "t": ("TAGS", "tags"),
+    "d": ("DESC", "desc"),
+    "e": ("EXISTS", "exists"),
+    "v": ("VISITED", "visit"),
+}
+
+
+def reportRows(ix, cols:str, tags:Sequence[str]=None, workers:int=None,
+               timeout:float=None) -> List[dict]:
+    """ One dict per distinct dir of index 'ix' having all of 'tags', in index
+    order.  Existence and last visits are only looked up if in 'cols'. """
+    from tox_auto import loadAutoCache
+    from tox_walk import chunkedMap
+    root = ix.indexRoot() + "/"
+    priorities:Dict[str,int] = {}
+    for path, priority in ix:
+        priorities.setdefault(path if path[0] == "/" else root + path, priority)
+    dirs = list(priorities)
+    cache = loadAutoCache(ix.path)
+    wanted = set(tags or ())
+    rows = []
+    unsure = []  # Rows whose dir had no .tox-auto: does it exist at all?
+    for dir, meta, error in cache.harvest(dirs, workers, timeout):
+        if wanted and not wanted.issubset(meta[1]):
+            continue
+        row = {"dir": dir, "priority": priorities[dir], "tags": list(meta[1]),
+               "desc": meta[2].strip(), "exists": None if error else True}
+        if error is None and meta[0] < 0:
+            unsure.append(row)
+        rows.append(row)
+    cache.save(dirs)
+    if "e" in cols and unsure:
+        byDir = {row["dir"]: row for row in unsure}
+        for dir, exists, error in chunkedMap(isdir, list(byDir), workers, timeout, False):
+            byDir[dir]["exists"] = None if error else exists
+    if "v" in cols:
+        visits = ix.visits()
+        for row in rows:
+            row["visit"] = visits.lastVisit(row["dir"]) if visits is not None else None
+    return rows
+
+
+def sortRows(rows:List[dict], key:str) -> List[dict]:
+    """ Sort by 'key': most important or most recent first for priority and
+    visit, alphabetically otherwise.  Stable, so ties stay in index order. """
+    if key == "priority":
+        rows.sort(key=lambda r: -r["priority"])
+    elif key == "visit":
+        rows.sort(key=lambda r: -(r.get("visit") or 0))
+    elif key == "tags":
+        rows.sort(key=lambda r: ",".join(r["tags"]))
+    else:
+        rows.sort(key=lambda r: r[key])
+    return rows
+
+
+def cellText(key:str, value) -> str:
+    if key == "tags":
+        return ",".join(value)
+    if key == "exists":
+        return "?" if value is None else "yes" if value else "no"
+    if key == "visit":
+        return time.strftime("%Y-%m-%d %H:%M", time.localtime(value)) if value else "-"
+    return str(value)
+
+
+def formatRows(rows:List[dict], cols:str, fmt:str) -> str:
+    keys = ["dir"] + [columns[c][1] for c in cols]
+    if fmt == "json":
+        import json
+        return json.dumps([{k: row[k] for k in keys} for row in rows], indent=1)
+    table = [["DIR"] + [columns[c][0] for c in cols]]
+    table.extend([cellText(k, row[k]) for k in keys] for row in rows)
+    if fmt == "tsv":
+        return "\n".join("\t".join(line) for line in table)
+    widths = [max(len(line[n]) for line in table) for n in range(len(keys) - 1)]
+    return "\n".join("  ".join([cell.ljust(w) for cell, w in zip(line, widths)] + [line[-1]]).rstrip()
+                     for line in table)
+
+
+def printReport(ix, cols:str, sortKey:str=None, tags:Sequence[str]=None, fmt:str="plain",
+                workers:int=None, timeout:float=None) -> bool:
+    """ Print the report of index 'ix' (with a leading '!', for tox_w).
+    Returns False if 'cols' has unknown columns, or nothing was reported. """
+    bad = [c for c in cols if c not in columns]
+    if bad:
+        sys.stderr.write("Unknown --report column(s) %s, use some of: %s\n"
+                         % ("".join(bad), "".join(columns)))
+        return False
+    rows = reportRows(ix, cols + ("v" if sortKey == "visit" else ""), tags, workers, timeout)
+    if sortKey:
+        sortRows(rows, sortKey)
+    sys.stdout.write("!" + formatRows(rows, cols, fmt or "plain") + "\n")
+    return len(rows) > 0
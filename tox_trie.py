@@ -0,0 +1,38 @@
+# tox_trie.py
+''' Subtree lookups over an index's entries, for multi-pattern queries.
+
+    `to proj src` picks a dir for 'proj', then matches 'src' only against
+    the entries below it.  This used to chdir into the dir and load its
+    index chain all over again for each further pattern.
+
+    PathTrie is a trie of the entries' absolute paths, one level per path
+    component, flattened into sorted order: everything below a node is then
+    one contiguous run of the sorted paths, found with two bisections.  That
+    needs no per-node objects, which matters for very large indices. '''
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Sequence
+
+
+class PathTrie(object):
+    ''' keys are the absolute paths of the entries, sorted, and ids[n] the
+    entry id of keys[n] '''
+    def __init__(self, keys:List[str], ids:Sequence[int]):
+        self.keys = keys
+        self.ids = ids
+
+    @classmethod
+    def build(cls, paths:Sequence[str]) -> "PathTrie":
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        return cls([paths[n] for n in order], array("I", order))
+
+    def below(self, dir:str) -> List[int]:
+        """ Ids of the entries strictly below dir, in index order """
+        prefix = dir.rstrip("/") + "/"
+        lo = bisect_left(self.keys, prefix)
+        # '0' is the character right after '/', so this is the end of the run:
+        hi = bisect_left(self.keys, prefix[:-1] + "0", lo)
+        return sorted(self.ids[lo:hi])
@@ -0,0 +1,196 @@
+# tox_visits.py
+''' Visit log: how often, and how recently, each index entry was chosen.
+
+    Each index gets a binary <index>.visits file.  Every successful `to`
+    appends one fixed-size (path key, time) record to it, which is a single
+    O_APPEND write.  Once enough records pile up, they're folded into a table
+    of per-key scores sorted by key, which is what a lookup mostly reads:
+    a bisect per matching entry, straight from the mapping.
+
+    A visit is worth 1 when it happens and halves every visitHalfLife
+    seconds, so a key's score is the sum over its visits of
+    2**-(age/visitHalfLife).  Since that's just a rescale as time passes, the
+    table only stores each score as of the time it was compacted, along
+    with the time of the key's last visit (for `--report v`).  Keys are
+    64 bit hashes of the absolute path: two paths colliding would merely
+    share a score.
+
+    Like the sidecar cache, failing to write the log (e.g. read-only shared
+    trees) is silently ignored.  A record appended while another process
+    compacts the log may be lost, which only costs a little ranking. '''
+from __future__ import annotations
+import os
+import sys
+import mmap
+import time
+import struct
+from bisect import bisect_left
+from zlib import adler32, crc32
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional
+
+visitsSuffix:str = ".visits"
+visitHalfLife:float = 14 * 24 * 3600.0
+visitCompactAt:int = 256     # Appended records which trigger a compaction
+visitMaxKeys:int = 4096      # Keys kept by a compaction, highest scores first
+visitMinScore:float = 0.01   # Scores below this are dropped by a compaction
+
+MAGIC = b"TOXV"
+VERSION = 2  # 1 had no last visit times; still readable
+# magic, version, little-endian flag, reference time, key count, then the
+# sorted keys, their scores and (version 2) their last visit times:
+HEADER = struct.Struct("<4sHHdQ")
+# key, time:
+RECORD = struct.Struct("<Qd")
+LITTLE = 1 if sys.byteorder == "little" else 0
+
+
+def visitsPath(indexPath:str) -> str:
+    return indexPath + visitsSuffix
+
+
+def pathKey(path:str) -> int:
+    b = path.encode("utf-8", "surrogateescape")
+    return crc32(b) << 32 | adler32(b)
+
+
+def decay(age:float) -> float:
+    return 2.0 ** (-age / visitHalfLife)
+
+
+class VisitLog(object):
+    ''' Read-only view of a visits file: the compacted table as memoryviews
+    into the mapping, plus the records appended since, grouped by key. '''
+    def __init__(self, mm:mmap.mmap, header:tuple):
+        _, version, _, self.refTime, count = header
+        self._mm = mm
+        view = memoryview(mm)
+        ofs = HEADER.size
+        self.keys = view[ofs:ofs + count * 8].cast("Q")
+        ofs += count * 8
+        self.scores = view[ofs:ofs + count * 8].cast("d")
+        ofs += count * 8
+        self.lasts = None
+        if version >= 2:
+            self.lasts = view[ofs:ofs + count * 8].cast("d")
+            ofs += count * 8
+        self.pending:Dict[int,List[float]] = {}
+        end = ofs + (len(mm) - ofs) // RECORD.size * RECORD.size
+        for key, t in RECORD.iter_unpack(mm[ofs:end]):
+            self.pending.setdefault(key, []).append(t)
+        self.appended = (end - ofs) // RECORD.size
+
+    def keyScore(self, key:int, now:float) -> float:
+        n = bisect_left(self.keys, key)
+        score = 0.0
+        if n < len(self.keys) and self.keys[n] == key:
+            score = self.scores[n] * decay(now - self.refTime)
+        for t in self.pending.get(key, ()):
+            score += decay(now - t)
+        return score
+
+    def keyLast(self, key:int) -> Optional[float]:
+        n = bisect_left(self.keys, key)
+        last = 0.0
+        if self.lasts is not None and n < len(self.keys) and self.keys[n] == key:
+            last = self.lasts[n]
+        last = max(self.pending.get(key, ()), default=last)
+        return last or None
+
+    def lastVisit(self, path:str) -> Optional[float]:
+        """ Time of the last visit of absolute path 'path', None if unknown """
+        return self.keyLast(pathKey(path))
+
+    def score(self, path:str, now:float=None) -> float:
+        """ Frecency of absolute path 'path' as of 'now' """
+        return self.keyScore(pathKey(path), time.time() if now is None else now)
+
+    def allScores(self, now:float) -> Dict[int,float]:
+        scores = dict(zip(self.keys.tolist(), (s * decay(now - self.refTime) for s in self.scores)))
+        for key, times in self.pending.items():
+            scores[key] = scores.get(key, 0.0) + sum(decay(now - t) for t in times)
+        return scores
+
+    def allLasts(self) -> Dict[int,float]:
+        lasts = dict(zip(self.keys.tolist(), self.lasts.tolist())) if self.lasts is not None else {}
+        for key, times in self.pending.items():
+            lasts[key] = max(times + [lasts.get(key, 0.0)])
+        return lasts
+
+
+def loadVisits(indexPath:str) -> Optional[VisitLog]:
+    """ Map the visits file of indexPath, None if it's missing or unusable """
+    try:
+        with open(visitsPath(indexPath), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        header = HEADER.unpack_from(mm, 0)
+    except struct.error:
+        mm.close()
+        return None
+    magic, version, little, _, count = header
+    if magic != MAGIC or little != LITTLE or version not in (1, VERSION) or \
+            HEADER.size + count * (8 + version * 8) > len(mm):
+        mm.close()
+        return None
+    return VisitLog(mm, header)
+
+
+def writeVisits(indexPath:str, scores:Dict[int,float], now:float,
+                lasts:Dict[int,float]=None) -> bool:
+    """ Atomically replace the visits file with a table of 'scores' as of
+    'now', and the last visit times in 'lasts' """
+    keep = sorted(scores.items(), key=lambda kv: -kv[1])[:visitMaxKeys]
+    keep = sorted(kv for kv in keep if kv[1] >= visitMinScore)
+    target = visitsPath(indexPath)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, LITTLE, now, len(keep)))
+            f.write(struct.pack(f"<{len(keep)}Q", *[kv[0] for kv in keep]))
+            f.write(struct.pack(f"<{len(keep)}d", *[kv[1] for kv in keep]))
+            f.write(struct.pack(f"<{len(keep)}d", *[(lasts or {}).get(kv[0], 0.0) for kv in keep]))
+        os.replace(tmp, target)
+        return True
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def compactVisits(indexPath:str, now:float=None) -> bool:
+    """ Fold the appended records into the score table, dropping the keys
+    which have faded away and keeping at most visitMaxKeys """
+    now = time.time() if now is None else now
+    log = loadVisits(indexPath)
+    if log is None:
+        return writeVisits(indexPath, {}, now)
+    return writeVisits(indexPath, log.allScores(now), now, log.allLasts())
+
+
+def recordVisit(indexPath:str, path:str, now:float=None) -> bool:
+    """ Append a visit of absolute path 'path' to the log of indexPath,
+    compacting the log if that's due.  Returns False if it can't be written. """
+    now = time.time() if now is None else now
+    target = visitsPath(indexPath)
+    if not os.path.exists(target) and not writeVisits(indexPath, {}, now):
+        return False
+    try:
+        fd = os.open(target, os.O_WRONLY | os.O_APPEND)
+    except OSError:
+        return False
+    try:
+        os.write(fd, RECORD.pack(pathKey(path), now))
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    log = loadVisits(indexPath)
+    if log is None or log.appended >= visitCompactAt:
+        return compactVisits(indexPath, now)
+    return True
@@ -0,0 +1,196 @@
+# tox_walk.py
+''' Parallel filesystem access.
+
+    Filesystem calls are mostly waiting (especially over NFS or automounts),
+    so TreeWalker (`to -a -r`) spreads os.scandir() calls over a bounded set
+    of threads and streams back every dir it finds, and boundedMap() does the
+    same for independent per-path calls such as the `to -c` existence checks
+    (chunkedMap() for calls so quick that they're better batched).
+    A call that takes longer than its timeout is abandoned (and reported)
+    rather than stalling everything else. '''
+import os
+import re
+import time
+import queue
+import fnmatch
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple
+
+defaultExcludes:List[str] = [".*"]  # Hidden dirs, including .git
+defaultWorkers:int = 8
+
+
+class DaemonPool(object):
+    ''' Minimal thread pool handing out concurrent.futures.Future objects.
+    Its workers are daemon threads, so a call stuck on a hung mount can simply
+    be abandoned: it won't block interpreter exit the way a
+    ThreadPoolExecutor's workers would. '''
+    def __init__(self, workers:int):
+        self._tasks = queue.Queue()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def _work(self) -> None:
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, fn, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            future.started = time.monotonic()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn:Callable, *args) -> Future:
+        future = Future()
+        future.started = None
+        self._tasks.put((future, fn, args))
+        return future
+
+    def replace(self) -> None:
+        """ Start a fresh worker to stand in for one stuck on an abandoned call """
+        t = threading.Thread(target=self._work, daemon=True)
+        self._threads.append(t)
+        t.start()
+
+    def close(self) -> None:
+        """ Let idle workers exit; busy (possibly hung) ones are left behind """
+        for _ in self._threads:
+            self._tasks.put(None)
+
+
+def overdue(future:Future, timeout:float, now:float) -> bool:
+    """ Has 'future' been running for longer than 'timeout' seconds? """
+    return timeout is not None and future.started is not None and now - future.started > timeout
+
+
+class TreeWalker(object):
+    ''' Yields every dir below a root, in no particular order.  Dirs matching
+    defaultExcludes or 'excludes' (globs on the name) are neither yielded nor
+    descended into.  Symlinks to dirs are yielded but not followed, as with os.walk. '''
+    def __init__(self, maxDepth:int=None, excludes:Sequence[str]=None, oneFileSystem:bool=False,
+                 timeout:float=None, workers:int=None):
+        self.maxDepth = maxDepth
+        globs = defaultExcludes + list(excludes or ())
+        self._excluded = re.compile("|".join(fnmatch.translate(g) for g in globs)).match if globs else None
+        self.oneFileSystem = oneFileSystem
+        self.timeout = timeout
+        self.workers = workers or defaultWorkers
+        self.timedOut:List[str] = []  # Dirs whose listing was abandoned
+        self.failed:List[str] = []    # Dirs we couldn't list at all
+
+    def _list(self, path:str, depth:int, dev:int) -> List[Tuple[str,bool]]:
+        """ Return (child dir, descend into it?) for each subdir of path """
+        children = []
+        descend = self.maxDepth is None or depth + 1 < self.maxDepth
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if not entry.is_dir():
+                        continue
+                    if self._excluded and self._excluded(entry.name):
+                        continue
+                    follow = descend and not entry.is_symlink()
+                    if follow and dev is not None:
+                        follow = entry.stat(follow_symlinks=False).st_dev == dev
+                except OSError:
+                    continue
+                children.append((entry.path, follow))
+        return children
+
+    def walk(self, root:str) -> Iterator[str]:
+        if self.maxDepth is not None and self.maxDepth < 1:
+            return
+        dev = os.stat(root).st_dev if self.oneFileSystem else None
+        pool = DaemonPool(self.workers)
+        try:
+            pending = {pool.submit(self._list, root, 0, dev): (root, 0)}
+            while pending:
+                done, _ = wait(pending, timeout=self.timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = pending.pop(future)
+                    try:
+                        children = future.result()
+                    except OSError:
+                        self.failed.append(path)
+                        continue
+                    for child, follow in children:
+                        yield child
+                        if follow:
+                            pending[pool.submit(self._list, child, depth + 1, dev)] = (child, depth + 1)
+                now = time.monotonic()
+                for future in [f for f in pending if overdue(f, self.timeout, now)]:
+                    self.timedOut.append(pending.pop(future)[0])
+                    pool.replace()
+        finally:
+            pool.close()
+
+
+class TimedOut(Exception):
+    ''' fn(item) didn't finish within boundedMap()'s per-item timeout '''
+
+
+def outcome(future:Future) -> Tuple[object,BaseException]:
+    """ (result, None) or (None, exception) of a completed future """
+    error = future.exception()
+    return (None, error) if error is not None else (future.result(), None)
+
+
+def boundedMap(fn:Callable, items:Iterable, workers:int=None, timeout:float=None,
+               ordered:bool=True) -> Iterator[Tuple[object,object,BaseException]]:
+    """ Call fn(item) for every item on a bounded pool of threads, yielding
+    (item, result, error) for each: 'error' is whatever fn raised, or TimedOut
+    if it ran for more than 'timeout' seconds.  Results come in input order,
+    or as they complete if not 'ordered'. """
+    pool = DaemonPool(workers or defaultWorkers)
+    try:
+        futures = [(pool.submit(fn, item), item) for item in items]
+        if ordered:
+            for future, item in futures:
+                while not future.done():
+                    now = time.monotonic()
+                    if overdue(future, timeout, now):
+                        break
+                    # Until it has started, just poll: it's queued behind others
+                    remaining = None if timeout is None else \
+                        timeout - (now - future.started if future.started else 0)
+                    wait([future], timeout=remaining)
+                if future.done():
+                    yield (item,) + outcome(future)
+                else:
+                    pool.replace()
+                    yield (item, None, TimedOut(item))
+        else:
+            pending = dict(futures)
+            while pending:
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield (pending.pop(future),) + outcome(future)
+                now = time.monotonic()
+                for future in [f for f in pending if overdue(f, timeout, now)]:
+                    pool.replace()
+                    item = pending.pop(future)
+                    yield (item, None, TimedOut(item))
+    finally:
+        pool.close()
+
+
+def chunkedMap(fn:Callable, items:Sequence, workers:int=None, timeout:float=None,
+               ordered:bool=True, chunk:int=32) -> Iterator[Tuple[object,object,BaseException]]:
+    """ boundedMap() for calls too quick to be worth a future each (say, a
+    stat on a local disk): each pool task calls fn on a run of up to 'chunk'
+    consecutive items.  A run that fails or takes longer than 'timeout'
+    seconds yields its error for each of its items. """
+    workers = workers or defaultWorkers
+    size = max(1, min(chunk, len(items) // (4 * workers)))
+    def run(part:Sequence) -> list:
+        return [fn(item) for item in part]
+    runs = [items[n:n + size] for n in range(0, len(items), size)]
+    for part, results, error in boundedMap(run, runs, workers, timeout, ordered):
+        for n, item in enumerate(part):
+            yield (item, None if results is None else results[n], error)